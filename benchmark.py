@@ -0,0 +1,867 @@
+import os
+import time
+import random
+import shelve
+import pickle
+import tempfile
+import requests
+import cbor
+import tracemalloc
+import re
+import json
+import resource
+import subprocess
+import multiprocessing
+from contextlib import redirect_stdout, redirect_stderr
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlparse
+import lxml.html as lh
+from bs4 import BeautifulSoup
+from argparse import ArgumentParser
+from hashlib import blake2b
+
+import numpy as np
+
+from crawler import Crawler
+from crawler.store import FrontierStore
+from crawler.frontier import Frontier
+from crawler.seen import SeenIndex
+from crawler.simhash import SimHash
+from crawler.fetcher import Fetcher
+from crawler.metrics import Metrics
+from utils import get_urlhash, normalize
+from utils.canonicalize import Canonicalizer
+from utils.cache_stub import CacheServerStub, save_pages, load_pages, make_raw_response
+from utils.charset import resolve_charset, detect_charset
+from utils.synthetic_web import SyntheticWeb
+from utils.url_filter import URLFilter
+from utils.response import Response
+from requests.utils import get_encoding_from_headers
+from queue import Queue
+from threading import Thread
+import scraper
+
+
+def synthetic_urls(n):
+    hosts = ["www.ics.uci.edu", "www.cs.uci.edu", "www.informatics.uci.edu", "www.stat.uci.edu"]
+    for i in range(n):
+        yield f"https://{hosts[i % len(hosts)]}/~user{i % 997}/page/{i}?id={i}"
+
+
+def bench_frontier(args):
+    """
+    Compare add_url throughput of the shelve save file against FrontierStore. The shelve only adds the first
+    shelve_urls urls: with dbm.dumb its syncs get slower with every url, a million would not finish.
+    """
+    shelve_urls = min(args.urls, args.shelve_urls)
+    with tempfile.TemporaryDirectory() as tmp:
+        def add_all(save, sync, n):
+            start = time.perf_counter()
+            for url in synthetic_urls(n):
+                urlhash = get_urlhash(url)
+                if urlhash not in save:
+                    save[urlhash] = (url, False)
+                    sync()
+            return time.perf_counter() - start
+
+        if shelve_urls > 0:
+            save = shelve.open(os.path.join(tmp, "frontier.shelve"))
+            shelve_time = add_all(save, save.sync, shelve_urls)
+            save.close()
+
+        save = FrontierStore(os.path.join(tmp, "frontier.db"), args.flush_interval)
+        store_time = add_all(save, save.sync, args.urls)
+        save.close()
+
+    print(f"add_url of {args.urls} urls")
+    if shelve_urls > 0:
+        print(f"shelve:        {shelve_time:8.2f}s  {shelve_urls / shelve_time:10.0f} urls/sec (first {shelve_urls} urls)")
+    else:
+        print("shelve:        skipped (--shelve_urls 0)")
+    print(f"FrontierStore: {store_time:8.2f}s  {args.urls / store_time:10.0f} urls/sec")
+
+
+def bench_frontier_queue(args):
+    """ Memory of the pending urls with a bounded head per host against keeping every url in memory. """
+    results = []
+    for head_size in (args.queue_head, args.urls):
+        with tempfile.TemporaryDirectory() as tmp:
+            config = BenchmarkConfig(tmp, seed_urls=[], queue_head_size=head_size)
+            frontier = Frontier(config, True)
+            tracemalloc.start()
+            start = time.perf_counter()
+            # the frontier holds the only reference to the urls, like urls parsed out of pages.
+            for url in synthetic_urls(args.urls):
+                frontier.add_url(url)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            downloaded = []
+            while True:
+                url = frontier.get_tbd_url()
+                if url is None:
+                    break
+                downloaded.append(url)
+                frontier.mark_url_complete(url)
+            elapsed = time.perf_counter() - start
+            frontier.close()
+        assert len(downloaded) == len(set(downloaded)) == args.urls, "frontier lost or repeated urls"
+        results.append((head_size, peak, elapsed))
+
+    print(f"add_url and get_tbd_url of {args.urls} urls on 4 hosts, every url downloaded once")
+    print("peak includes the seen index, which keeps about 36 bytes per url")
+    for head_size, peak, elapsed in results:
+        print(f"head of {head_size:8d} urls per host: peak {peak / 2 ** 20:8.1f} MiB, {elapsed:6.2f}s")
+
+
+def synthetic_outlinks(pages, links, seed=0):
+    """ Yield the outlinks of pages, links per page, a third of them repeated within the page or across pages. """
+    rng = random.Random(seed)
+    hosts = ["www.ics.uci.edu", "www.cs.uci.edu", "www.informatics.uci.edu", "www.stat.uci.edu"]
+    for i in range(pages):
+        outlinks = [f"https://{rng.choice(hosts)}/~user{rng.randrange(997)}/page/{i}/{j}" for j in range(links)]
+        for j in range(links // 3):
+            outlinks[j] = rng.choice(outlinks) if j % 2 else f"https://www.ics.uci.edu/nav/{rng.randrange(50)}"
+        yield outlinks
+
+
+def bench_frontier_add(args):
+    """ Frontier time per page for its outlinks, with one add_url per link against one add_urls per page. """
+    results = []
+    for flush_interval in (0.0, args.flush_interval):
+        for name in ("add_url", "add_urls"):
+            with tempfile.TemporaryDirectory() as tmp:
+                config = BenchmarkConfig(tmp, seed_urls=[], flush_interval=flush_interval)
+                frontier = Frontier(config, True)
+                pages = list(synthetic_outlinks(args.pages, args.links))
+                start = time.perf_counter()
+                for outlinks in pages:
+                    if name == "add_url":
+                        for url in outlinks:
+                            frontier.add_url(url)
+                    else:
+                        frontier.add_urls(outlinks)
+                elapsed = time.perf_counter() - start
+                queued = sum(len(queue) for queue in frontier.host_queues.values())
+                frontier.close()
+            results.append((flush_interval, name, elapsed, queued))
+
+    print(f"{args.pages} pages with {args.links} outlinks each")
+    for flush_interval, name, elapsed, queued in results:
+        print(f"FLUSHINTERVAL {flush_interval:4.1f}s {name:<8}: {elapsed / args.pages * 1000:8.3f} ms/page, "
+              f"{queued} urls queued")
+
+
+def bench_resume(args):
+    """ Time until the first url of a resumed frontier, against reading the whole save file first. """
+    with tempfile.TemporaryDirectory() as tmp:
+        config = BenchmarkConfig(tmp)
+        save = FrontierStore(config.save_file, batch_size=100000)
+        rng = random.Random(0)
+        for url in synthetic_urls(args.urls):
+            save[get_urlhash(url)] = (url, rng.random() >= args.pending)
+        save.close()
+
+        # what the frontier did before: every record is read and checked before the first download.
+        start = time.perf_counter()
+        save = FrontierStore(config.save_file)
+        seen = SeenIndex()
+        tbd = []
+        for urlhash, (url, completed) in save.items():
+            seen.add(urlhash)
+            if not completed and scraper.is_valid(url):
+                tbd.append(url)
+        full_scan_time = time.perf_counter() - start
+        save.close()
+
+        start = time.perf_counter()
+        frontier = Frontier(config, False)
+        frontier.get_tbd_url()
+        first_url_time = time.perf_counter() - start
+        frontier.loader.join()
+        loaded_time = time.perf_counter() - start
+        queued = sum(len(queue) for queue in frontier.host_queues.values()) + frontier.in_flight
+        frontier.close()
+
+    assert queued == len(tbd), "resumed frontier queued a different number of urls"
+    print(f"resume from {args.urls} urls, {len(tbd)} pending")
+    print(f"full scan before first url: {full_scan_time:8.2f}s")
+    print(f"first url:                  {first_url_time:8.2f}s")
+    print(f"pending urls and seen index loaded in the background after {loaded_time:.2f}s")
+
+
+def bench_metrics(args):
+    """ Cost of the instrumentation a page goes through: 10 stage timings and 2 counters. """
+    metrics = Metrics()
+    stages = ["frontier get", "download", "parse", "tokenize", "fingerprint", "simhash", "stats", "scrape",
+              "frontier add", "frontier complete"]
+    start = time.perf_counter()
+    for _ in range(args.pages):
+        for stage in stages:
+            metrics.observe(stage, time.perf_counter())
+        metrics.count("pages")
+        metrics.fetched("www.ics.uci.edu", 200)
+    elapsed = time.perf_counter() - start
+    print(f"instrumentation of {args.pages} pages: {elapsed / args.pages * 1e6:6.2f} us/page")
+
+
+def crawl_once(options):
+    """
+    Crawl a synthetic or replayed web served by a local cache server stub, in a fresh process so the
+    peak RSS is the crawl's own. Runs in options["directory"], where the crawler writes its files.
+    """
+    os.chdir(options["directory"])
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull), redirect_stderr(devnull):
+        if options["replay"]:
+            pages = load_pages(options["replay"])
+            seed_urls = [options["seed_url"]]
+        else:
+            pages = SyntheticWeb(**options["web"])
+            seed_urls = pages.seed_urls
+        recorded = dict()
+        requested = []
+
+        def answer(url):
+            requested.append(url)
+            page = pages(url) if callable(pages) else pages.get(url)
+            if page is not None and options["record"]:
+                recorded[url] = page
+                if len(page) > 3:
+                    # a crawl in another order may request the redirect target itself
+                    recorded.setdefault(page[3], page[:3])
+            return page
+
+        stub = CacheServerStub(answer, latency=options["latency"]).start()
+        config = BenchmarkConfig(
+            options["directory"], cache_server=stub.address, seed_urls=seed_urls, time_delay=options["politeness"],
+            threads_count=options["threads"], fetchers_count=options["fetchers"], parsers_count=options["parsers"],
+            max_in_flight=max(options["threads"], options["fetchers"]), metrics_interval=3600.0,
+            priority_policy=options["priority"],
+            simhash_file=os.path.join(options["directory"], "simhash.shelve") if options["simhash"] else None)
+        start = time.perf_counter()
+        crawler = Crawler(config, True)
+        crawler.start()
+        elapsed = time.perf_counter() - start
+        stub.stop()
+        if options["record"]:
+            save_pages(recorded, options["record"])
+    snapshot = crawler.metrics.snapshot()
+    # pages counted within the first half of the requests, how soon the crawl reaches the useful pages
+    half = requested[:len(requested) // 2]
+    useful_half = sum(int(get_urlhash(url)[:16], 16) in crawler.stats.crawled_hashes for url in half)
+    return {
+        "useful_in_half": useful_half,
+        "pages": len(crawler.stats), "requests": stub.requests_count, "elapsed": round(elapsed, 3),
+        "pages_per_sec": round(len(crawler.stats) / elapsed, 2),
+        "stages": {stage: summary["mean"] for stage, summary in snapshot["stages"].items()},
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+
+
+def bench_crawl(args):
+    """ End to end crawls with the Crawler against a local stub, for every thread count in --threads. """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    web = {"pages": args.pages, "hosts": args.hosts, "fan_out": args.fan_out, "duplicates": args.duplicates,
+           "redirects": args.redirects, "non_html": args.non_html, "traps": args.traps, "archives": args.archives}
+    print(f"crawl of {args.replay or web}, {args.latency * 1000:.1f} ms cache latency, {args.politeness}s politeness, "
+          f"{args.priority} priority")
+    print(f"{'threads':>7} {'pages':>6} {'requests':>8} {'in half':>7} {'seconds':>8} {'pages/s':>8} {'RSS MiB':>8}  "
+          f"slowest stages (mean ms)")
+    for threads in (int(threads) for threads in args.threads.split(",")):
+        with tempfile.TemporaryDirectory() as tmp:
+            # crawl_once runs in tmp, the files given relative to here need absolute paths
+            options = {
+                "directory": tmp, "web": web, "seed_url": args.seed_url,
+                "replay": args.replay and os.path.abspath(args.replay),
+                "record": args.record and os.path.abspath(args.record),
+                "latency": args.latency, "politeness": args.politeness, "threads": threads, "fetchers": args.fetchers,
+                "parsers": args.parsers, "simhash": args.simhash, "priority": args.priority}
+            # spawn: the crawl process starts without the memory and threads of this one.
+            with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                result = executor.submit(crawl_once, options).result()
+        stages = sorted(result["stages"].items(), key=lambda item: item[1], reverse=True)[:4]
+        print(f"{threads:>7} {result['pages']:>6} {result['requests']:>8} {result['useful_in_half']:>7} "
+              f"{result['elapsed']:>8.2f} "
+              f"{result['pages_per_sec']:>8.1f} {result['peak_rss_mb']:>8.1f}  "
+              + ", ".join(f"{stage} {seconds * 1000:.2f}" for stage, seconds in stages))
+        if args.output:
+            with open(args.output, 'a', encoding="utf-8") as file:
+                options = {key: value for key, value in options.items() if key != "directory"}
+                file.write(json.dumps({"time": time.time(), "commit": commit, "options": options, **result}) + "\n")
+
+
+def synthetic_word_freqs(n, vocabulary_size=20000, tokens_per_page=500, seed=0):
+    rng = random.Random(seed)
+    vocabulary = [f"word{i}" for i in range(vocabulary_size)]
+    for _ in range(n):
+        word_freq = dict()
+        for token in rng.choices(vocabulary, k=tokens_per_page):
+            word_freq[token] = word_freq.get(token, 0) + 1
+        yield word_freq
+
+
+def reference_simhash(word_freq, digest_size=32):
+    """ Bit by bit simhash, keeping the leading zero bits of every byte. """
+    simhash = [0] * (digest_size * 8)
+    for token, freq in word_freq.items():
+        hash_bytes = blake2b(token.encode("utf-8"), digest_size=digest_size).digest()
+        bits = "".join(format(byte_int, "08b") for byte_int in hash_bytes)
+        for i, bit in enumerate(bits):
+            simhash[i] += freq if bit == "1" else -freq
+    return np.packbits(np.array(simhash) > 0).tobytes()
+
+
+def bench_simhash(args):
+    """ Check SimHash._compute_simhash against reference_simhash and time both. """
+    pages = list(synthetic_word_freqs(args.pages, tokens_per_page=args.tokens))
+    start = time.perf_counter()
+    expected = [reference_simhash(word_freq) for word_freq in pages]
+    reference_time = time.perf_counter() - start
+    start = time.perf_counter()
+    actual = [SimHash._compute_simhash(word_freq) for word_freq in pages]
+    vectorized_time = time.perf_counter() - start
+
+    assert actual == expected, "vectorized simhash differs from the reference implementation"
+    assert SimHash._compute_simhash({}) == bytes(32)
+    print(f"simhash of {args.pages} pages with {args.tokens} tokens each, identical fingerprints")
+    print(f"reference:  {reference_time / args.pages * 1000:8.3f} ms/page")
+    print(f"vectorized: {vectorized_time / args.pages * 1000:8.3f} ms/page")
+
+
+class BenchmarkConfig(object):
+    """ The attributes of utils.config.Config the benchmarked components read. """
+    def __init__(self, directory, **overrides):
+        self.save_file = os.path.join(directory, "frontier.db")
+        self.flush_interval = 1.0
+        self.queue_head_size = 1000
+        self.spill_dir = os.path.join(directory, "frontier_spill")
+        self.simhash_file = os.path.join(directory, "simhash.shelve")
+        self.page_store = None
+        self.priority_policy = "yield"
+        self.priority_depth_weight = 0.1
+        self.priority_novelty_weight = 1.0
+        self.seed_urls = ["https://www.ics.uci.edu"]
+        self.time_delay = 0
+        self.threads_count = 1
+        self.fetchers_count = 0
+        self.download_queue_size = 16
+        self.parsers_count = 0
+        self.stats_checkpoint_pages = 100
+        self.stats_checkpoint_interval = 60.0
+        self.trap_rules = None
+        self.canonical_rules = None
+        self.metrics_file = os.path.join(directory, "metrics.jsonl")
+        self.metrics_interval = 60.0
+        self.strip_params = None
+        self.trap_file = os.path.join(directory, "traps.json")
+        self.trap_max_depth = 12
+        self.trap_max_repeats = 3
+        self.trap_query_variants = 200
+        self.trap_date_urls = 100
+        self.trap_duplicate_rate = 0.5
+        self.trap_duplicate_samples = 20
+        self.user_agent = "IR UF22 benchmark"
+        self.cache_server = None
+        self.max_in_flight = 8
+        self.download_timeout = 30
+        self.download_retries = 3
+        self.download_backoff = 0.5
+        for name, value in overrides.items():
+            setattr(self, name, value)
+
+
+def bench_simhash_index(args):
+    """ Compare near duplicate lookups of the LSH index against a scan of the simhash file. """
+    rng = np.random.default_rng(0)
+    stored = rng.integers(0, 256, size=(args.fingerprints, SimHash.digest_size), dtype=np.uint8)
+    with tempfile.TemporaryDirectory() as tmp:
+        simhash = SimHash(BenchmarkConfig(tmp), restart=True)
+        for i, fingerprint in enumerate(stored):
+            simhash._insert(f"https://www.ics.uci.edu/page/{i}", fingerprint.tobytes())
+        simhash.save.sync()
+
+        queries = []
+        for i in rng.integers(0, args.fingerprints, size=args.queries):
+            # flip one bit of a stored fingerprint: a near duplicate at similarity 255/256
+            query = stored[i].copy()
+            query[rng.integers(0, SimHash.digest_size)] ^= 1 << int(rng.integers(0, 8))
+            queries.append(query.tobytes())
+
+        start = time.perf_counter()
+        indexed = [simhash._nearest(query) for query in queries]
+        index_time = time.perf_counter() - start
+
+        scan_queries = queries[:args.scan_queries]
+        start = time.perf_counter()
+        scanned = [max((SimHash._similarity(vector, query), url) for url, vector in simhash.save.items())
+                   for query in scan_queries]
+        scan_time = time.perf_counter() - start
+        simhash.save.close()
+
+    assert all(index[1] == scan[0] for index, scan in zip(indexed, scanned)), "index missed a near duplicate"
+    print(f"near duplicate lookup against {args.fingerprints} stored fingerprints")
+    print(f"simhash file scan: {scan_time / len(scan_queries) * 1000:10.3f} ms/query")
+    print(f"LSH band index:    {index_time / len(queries) * 1000:10.3f} ms/query")
+
+
+def bench_download(args):
+    """ Compare a fresh connection per request against the pooled fetcher pipeline, on a local cache server stub. """
+    html = b"<html><body>" + b"<p>some words on the page</p>" * 200 + b"</body></html>"
+    stub = CacheServerStub(lambda url: (200, {"Content-Type": "text/html; charset=utf-8"}, html),
+                           latency=args.latency).start()
+    urls = list(synthetic_urls(args.pages))
+
+    def run_threads(target):
+        chunks = [urls[i::args.in_flight] for i in range(args.in_flight)]
+        threads = [Thread(target=target, args=(chunk,)) for chunk in chunks]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start
+
+    def fresh_connections(chunk):
+        host, port = stub.address
+        for url in chunk:
+            resp = requests.get(f"http://{host}:{port}/", params=[("q", url), ("u", "IR UF22 benchmark")])
+            Response(cbor.loads(resp.content))
+
+    fresh_time = run_threads(fresh_connections)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config = BenchmarkConfig(tmp, cache_server=stub.address, max_in_flight=args.in_flight)
+
+        class UrlList(object):
+            """ Hands out the benchmark urls like the frontier does. """
+            def __init__(self):
+                self.urls = list(urls)
+
+            def get_tbd_url(self):
+                try:
+                    return self.urls.pop()
+                except IndexError:
+                    return None
+
+        downloads = Queue(maxsize=args.queue_size)
+        frontier = UrlList()
+        fetchers = [Fetcher(i, config, frontier, downloads) for i in range(args.in_flight)]
+        start = time.perf_counter()
+        for fetcher in fetchers:
+            fetcher.start()
+        received = 0
+        while received < len(urls):
+            url, resp = downloads.get()
+            assert resp is not None and resp.status == 200
+            received += 1
+        pooled_time = time.perf_counter() - start
+    stub.stop()
+
+    print(f"{args.pages} downloads, {args.in_flight} in flight, {args.latency * 1000:.0f} ms server latency")
+    print(f"new connection per request: {args.pages / fresh_time:8.0f} pages/sec")
+    print(f"pooled fetcher pipeline:    {args.pages / pooled_time:8.0f} pages/sec")
+
+
+def synthetic_ics_pages(n, seed=0):
+    """ Yield (url, html bytes) of pages shaped like ICS department pages. """
+    rng = random.Random(seed)
+    words = ["research", "students", "faculty", "computing", "informatics", "course", "seminar", "lab",
+             "machine", "learning", "systems", "graduate", "undergraduate", "&amp;", "ICS", "UCI", "2022"]
+    for i in range(n):
+        url = f"https://www.ics.uci.edu/~user{i}/courses/index.html"
+        nav = "".join(f'<li><a href="/about/{j}.php#top">About {j}</a></li>' for j in range(rng.randint(10, 40)))
+        paragraphs = "".join(
+            "<p>" + " ".join(rng.choice(words) for _ in range(rng.randint(20, 120)))
+            + f' <a href="../papers/p{j}.pdf">paper</a> <a href="https://www.cs.uci.edu/news/{j}#c">news</a></p>'
+            for j in range(rng.randint(5, 60)))
+        html = ("<!DOCTYPE html><html><head><title>ICS page</title>"
+                "<style>body { font-family: sans-serif; }</style>"
+                '<script src="/js/site.js"></script><script>var tracking = "do not count these words";</script>'
+                '<link rel="stylesheet" href="/css/site.css"></head><body><!-- navigation -->'
+                f"<ul>{nav}</ul><div id=\"content\">{paragraphs}</div></body></html>")
+        yield url, html.encode("utf-8")
+
+
+def reference_parse(text, content, url):
+    """ The html path of extract_next_links before the single lxml pass: BeautifulSoup for text, lxml for links. """
+    soup = BeautifulSoup(text, "html.parser")
+    doc = lh.fromstring(content, url)
+    doc.make_links_absolute()
+    urls = [scraper.urlparse(link)._replace(fragment="").geturl() for _, _, link, _ in doc.iterlinks()]
+    return soup.get_text(), urls
+
+
+def bench_parse(args):
+    """
+    Compare the BeautifulSoup + lxml html parsing with the single lxml pass, per page time and peak memory.
+    Peak memory comes from tracemalloc, which sees Python allocations but not the trees libxml2 allocates itself.
+    """
+    if args.corpus:
+        pages = []
+        for name in sorted(os.listdir(args.corpus)):
+            with open(os.path.join(args.corpus, name), 'rb') as file:
+                pages.append((f"https://www.ics.uci.edu/{name}", file.read()))
+    else:
+        pages = list(synthetic_ics_pages(args.pages))
+
+    def measure(parse):
+        results, peaks = [], []
+        start = time.perf_counter()
+        for url, content in pages:
+            text = content.decode("utf-8", errors="replace")
+            results.append(parse(text, content, url))
+        elapsed = time.perf_counter() - start
+        for url, content in pages[:args.memory_pages]:
+            text = content.decode("utf-8", errors="replace")
+            tracemalloc.start()
+            parse(text, content, url)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        return results, elapsed / len(pages), sum(peaks) / len(peaks)
+
+    reference, reference_time, reference_peak = measure(reference_parse)
+    single, single_time, single_peak = measure(lambda text, content, url: scraper.html_text_and_links(text, content, "utf-8", url))
+
+    link_mismatches = sum(old_links != new_links for (_, old_links), (_, new_links) in zip(reference, single))
+    token_mismatches = 0
+    for (url, content), (new_text, _) in zip(pages, single):
+        # the reference text includes script and style contents, the single pass leaves them out on purpose
+        soup = BeautifulSoup(content.decode("utf-8", errors="replace"), "html.parser")
+        for element in soup(["script", "style"]):
+            element.decompose()
+        token_mismatches += len(scraper.tokenize(soup.get_text())) != len(scraper.tokenize(new_text))
+
+    print(f"{len(pages)} pages")
+    print(f"BeautifulSoup + lxml: {reference_time * 1000:8.3f} ms/page, peak {reference_peak / 1024:8.1f} KiB")
+    print(f"single lxml pass:     {single_time * 1000:8.3f} ms/page, peak {single_peak / 1024:8.1f} KiB")
+    print(f"pages with different links: {link_mismatches}, with different token counts: {token_mismatches}")
+
+
+# words of the scripts the encodings below can encode
+SCRIPT_WORDS = {
+    "latin": ["café", "naïve", "résumé", "Zürich", "façade", "señor", "coöperate", "déjà"],
+    "japanese": ["情報", "計算機", "科学", "大学", "研究", "学生"],
+    "chinese": ["信息", "计算机", "科学", "大学", "研究", "学生"],
+    "russian": ["информатика", "наука", "университет", "студент", "исследование"]}
+ENCODING_SCRIPTS = [
+    ("utf-8", list(SCRIPT_WORDS)), ("cp1252", ["latin"]), ("shift_jis", ["japanese"]), ("gb2312", ["chinese"]),
+    ("koi8_r", ["russian"]), ("utf-16", ["latin", "russian"])]
+
+
+def mixed_encoding_pages(n, seed=0):
+    """
+    Yield (text, headers, content) of html pages in the encodings of ENCODING_SCRIPTS. The encoding is declared
+    in the Content-Type header, in a meta charset only, or nowhere (utf-16 pages still start with a BOM).
+    """
+    rng = random.Random(seed)
+    ascii_words = ["research", "students", "faculty", "computing", "informatics", "seminar", "2022"]
+    for _ in range(n):
+        encoding, scripts = rng.choice(ENCODING_SCRIPTS)
+        declared = rng.choice(["header", "meta", "none"])
+        if encoding == "utf-16" and declared == "meta":
+            declared = "header"
+        words = ascii_words + [word for script in scripts for word in SCRIPT_WORDS[script]]
+        meta = f'<meta charset="{encoding}">' if declared == "meta" else ""
+        body = "".join(
+            "<p>" + " ".join(rng.choice(words) for _ in range(rng.randint(20, 120))) + "</p>"
+            for _ in range(rng.randint(20, 120)))
+        text = f"<!DOCTYPE html><html><head>{meta}<title>ICS page</title></head><body>{body}</body></html>"
+        content_type = f"text/html; charset={encoding}" if declared == "header" else "text/html"
+        yield text, {"Content-Type": content_type}, text.encode(encoding)
+
+
+def legacy_decode(raw_response):
+    """ How parse_page decoded a page before utils.charset: requests' encoding, then apparent_encoding. """
+    if 'Content-Type' in raw_response.headers:
+        charset = raw_response.encoding
+    else:
+        charset = raw_response.apparent_encoding
+    if charset is None:
+        charset = 'utf-8'
+    try:
+        return raw_response.content.decode(charset)
+    except UnicodeDecodeError:
+        if raw_response.apparent_encoding is not None:
+            return raw_response.content.decode(raw_response.apparent_encoding)
+        raise
+
+
+def resolved_decode(raw_response):
+    """ How parse_page decodes a page with utils.charset. """
+    charset = resolve_charset(raw_response.content, raw_response.headers.get('Content-Type'))
+    try:
+        return raw_response.content.decode(charset)
+    except UnicodeDecodeError:
+        return raw_response.content.decode(detect_charset(raw_response.content), errors="replace")
+
+
+def bench_charset(args):
+    """
+    Charset handling over mixed-encoding pages: time per page and pages decoded to their original text with
+    the previous decoding and with utils.charset. Then the time to build a utils.response.Response and get
+    its final_url and location, eagerly unpickled as before or lazily, for a mix of 200 and other statuses.
+    """
+    pages = []
+    for text, headers, content in mixed_encoding_pages(args.pages):
+        raw = make_raw_response("https://www.ics.uci.edu/", 200, headers, content)
+        # what requests sets, ISO-8859-1 for a text/html header without charset
+        raw.encoding = get_encoding_from_headers(raw.headers)
+        pages.append((text, raw))
+    print(f"{len(pages)} pages, {sum(len(raw.content) for _, raw in pages) / len(pages) / 1024:.1f} KiB on average")
+    for name, decode in [("requests encoding + apparent_encoding", legacy_decode), ("utils.charset", resolved_decode)]:
+        correct, errors = 0, 0
+        start = time.perf_counter()
+        for text, raw in pages:
+            try:
+                correct += decode(raw) == text
+            except (UnicodeDecodeError, LookupError):
+                errors += 1
+        elapsed = time.perf_counter() - start
+        print(f"{name:<38} {elapsed / len(pages) * 1000:8.3f} ms/page, {correct} decoded correctly, {errors} errors")
+
+    rng = random.Random(0)
+    payloads = []
+    for i, (_, raw) in enumerate(pages):
+        status = 200 if rng.random() < args.ok_rate else rng.choice([301, 404, 500])
+        raw.status_code = status
+        payloads.append({"url": raw.url, "status": status, "response": pickle.dumps(raw)})
+    for name, lazy in [("eager Response", False), ("lazy Response", True)]:
+        start = time.perf_counter()
+        for payload in payloads:
+            resp = Response(payload)
+            if not lazy:
+                resp.raw_response
+            resp.location, resp.final_url
+        elapsed = time.perf_counter() - start
+        print(f"{name:<38} {elapsed / len(payloads) * 1000:8.3f} ms/response")
+
+
+def legacy_is_valid(url):
+    """ scraper.is_valid before the URLFilter rule engine, kept to check parity. """
+    try:
+        parsed = urlparse(url)
+        if parsed.scheme not in {"http", "https"}:
+            return False
+        elif all(re.match(".*" + d + "$", parsed.hostname) is None for d in scraper.domains):
+            return False
+        elif all(d not in parsed.hostname for d in scraper.domains):
+            return False
+        elif "swiki.ics.uci.edu" in parsed.hostname:
+            return False
+        elif "archive.ics.uci.edu" in parsed.hostname and "ml/datasets.php" in parsed.path:
+            return False
+        elif "wics.ics.uci.edu" in parsed.hostname and "events" in parsed.path:
+            return False
+        elif "cbcl.ics.uci.edu" in parsed.hostname and "do=diff" in parsed.query:
+            return False
+        elif re.match(".*" + "today.uci.edu" + "$", parsed.hostname) is not None:
+            if "department/information_computer_sciences" not in parsed.path:
+                return False
+        return not re.match(
+            r".*\.(css|js|bmp|gif|jpe?g|ico"
+            + r"|png|tiff?|mid|mp2|mp3|mp4|webm"
+            + r"|wav|avi|mov|mpeg|ram|m4v|mkv|ogg|ogv|pdf"
+            + r"|ps|eps|tex|ppt|pptx|doc|docx|xls|xlsx|names"
+            + r"|data|dat|exe|bz2|tar|msi|bin|7z|psd|dmg|iso"
+            + r"|epub|dll|cnf|tgz|sha1"
+            + r"|thmx|mso|arff|rtf|jar|csv"
+            + r"|rm|smil|wmv|swf|wma|zip|rar|gz"
+            + r"|r|bib|py|git|pdf)$", parsed.path.lower())
+    except TypeError:
+        return False
+
+
+def realistic_urls(n, seed=0):
+    """ Outlinks like the ones found on ICS pages: in and out of the allowed domains, traps, files. """
+    rng = random.Random(seed)
+    hosts = ["www.ics.uci.edu", "vision.ics.uci.edu", "swiki.ics.uci.edu", "archive.ics.uci.edu",
+             "wics.ics.uci.edu", "cbcl.ics.uci.edu", "ngs.ics.uci.edu", "www.cs.uci.edu", "www.informatics.uci.edu",
+             "www.stat.uci.edu", "today.uci.edu", "www.uci.edu", "www.cecs.uci.edu", "physics.uci.edu",
+             "ics.uci.edu", "www.google.com", "github.com", "WWW.ICS.UCI.EDU"]
+    paths = ["/", "/about/index.php", "/~eppstein/pubs/a.pdf", "/ml/datasets.php", "/events/2022-01-20/",
+             "/doku.php/start", "/department/information_computer_sciences/news", "/img/logo.PNG",
+             "/courses/cs121/slides.pptx", "/community/news/view_news?id=1", "/r", "/data.csv"]
+    queries = ["", "", "", "do=diff", "id=42&rev=3", "ical=1", "share=twitter"]
+    schemes = ["https", "https", "http", "mailto", "javascript"]
+    for _ in range(n):
+        query = rng.choice(queries)
+        yield f"{rng.choice(schemes)}://{rng.choice(hosts)}{rng.choice(paths)}" + (f"?{query}" if query else "")
+
+
+def url_spellings(n, seed=0):
+    """ Links to n pages, each page spelled the ways links on real pages spell it. """
+    rng = random.Random(seed)
+    spellings = [
+        lambda host, path, query: f"https://{host}{path}{query}",
+        lambda host, path, query: f"https://{host.upper()}{path}{query}",
+        lambda host, path, query: f"https://{host}:443{path}{query}",
+        # a trailing slash or an index page in front of a query names another page
+        lambda host, path, query: f"https://{host}{path}{query or '/'}",
+        lambda host, path, query: f"https://{host}{path}{query or '/index.html'}",
+        lambda host, path, query: f"https://{host}{path}{query}{'&' if query else '?'}utm_source=news",
+        lambda host, path, query: f"https://{host}{path}{query}#section",
+        lambda host, path, query: f"https://{host}{path}" + ("?" + "&".join(reversed(query[1:].split("&"))) if query else ""),
+        lambda host, path, query: f"https://{host}{path};jsessionid=A1B2C3{query}",
+    ]
+    hosts = ["www.ics.uci.edu", "vision.ics.uci.edu", "www.informatics.uci.edu", "www.stat.uci.edu"]
+    for i in range(n):
+        host, path = hosts[i % len(hosts)], f"/~user{i % 97}/pages/p%7e{i}"
+        query = f"?id={i}&lang=en" if i % 3 == 0 else ""
+        for spelling in rng.sample(spellings, 3):
+            yield spelling(host, path, query)
+
+
+def bench_canonicalize(args):
+    """ Frontier entries and canonicalization time for links spelling the same pages differently. """
+    links = list(url_spellings(args.pages))
+    legacy = {get_urlhash(normalize(url)) for url in links if scraper.is_valid(url)}
+    canonicalizer = Canonicalizer()
+    start = time.perf_counter()
+    canonical_links = canonicalizer.collapse(links)
+    elapsed = time.perf_counter() - start
+    canonical = {get_urlhash(url) for url in canonical_links if scraper.is_valid(url)}
+    print(f"{len(links)} links to {args.pages} pages")
+    print(f"frontier entries with utils.normalize: {len(legacy):8d}")
+    print(f"frontier entries with Canonicalizer:   {len(canonical):8d}")
+    print(canonicalizer.summary())
+    print(f"collapse: {elapsed / len(links) * 1e6:6.2f} us/link")
+
+
+def bench_url_filter(args):
+    """ Check URLFilter.is_valid against the legacy is_valid on realistic urls and time both. """
+    urls = list(realistic_urls(args.urls))
+    start = time.perf_counter()
+    expected = [bool(legacy_is_valid(url)) for url in urls]
+    legacy_time = time.perf_counter() - start
+    url_filter = URLFilter(scraper.domains)
+    start = time.perf_counter()
+    actual = [url_filter.is_valid(url) for url in urls]
+    filter_time = time.perf_counter() - start
+
+    mismatches = [url for url, old, new in zip(urls, expected, actual) if old != new]
+    print(f"is_valid of {args.urls} urls, {sum(actual)} valid, {len(mismatches)} differ from the legacy is_valid")
+    for url in sorted(set(mismatches))[:10]:
+        print(f"  {url}")
+    print(f"legacy is_valid: {legacy_time / args.urls * 1e6:8.3f} us/url")
+    print(f"URLFilter:       {filter_time / args.urls * 1e6:8.3f} us/url")
+
+
+def bench_tokenize(args):
+    """ Compare tokenize + compute_word_frequencies with count_words on long pages. """
+    rng = random.Random(0)
+    vocabulary = [f"Word{i}" for i in range(5000)] + ["ICS", "U.C.I.", "e-mail", "don't", "(c)", "2022-01-20"]
+    pages = [" ".join(rng.choice(vocabulary) for _ in range(args.words)) for _ in range(args.pages)]
+
+    start = time.perf_counter()
+    expected = []
+    for text in pages:
+        tokens = scraper.tokenize(text)
+        expected.append((scraper.compute_word_frequencies(tokens), len(tokens)))
+    two_pass_time = time.perf_counter() - start
+    start = time.perf_counter()
+    actual = [scraper.count_words(text) for text in pages]
+    one_pass_time = time.perf_counter() - start
+
+    assert actual == expected, "count_words differs from tokenize + compute_word_frequencies"
+    print(f"{args.pages} pages of {args.words} words, identical counts")
+    print(f"tokenize + compute_word_frequencies: {two_pass_time / args.pages * 1000:8.3f} ms/page")
+    print(f"count_words:                         {one_pass_time / args.pages * 1000:8.3f} ms/page")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    frontier_parser = subparsers.add_parser("frontier", help="frontier save file add_url throughput")
+    frontier_parser.add_argument("--urls", type=int, default=1000000)
+    frontier_parser.add_argument("--flush_interval", type=float, default=1.0)
+    frontier_parser.add_argument("--shelve_urls", type=int, default=5000, help="urls the shelve baseline adds, 0 to skip it")
+    frontier_parser.set_defaults(func=bench_frontier)
+
+    queue_parser = subparsers.add_parser("frontier-queue", help="frontier memory with spilled host queues")
+    queue_parser.add_argument("--urls", type=int, default=500000)
+    queue_parser.add_argument("--queue_head", type=int, default=1000)
+    queue_parser.set_defaults(func=bench_frontier_queue)
+
+    add_parser = subparsers.add_parser("frontier-add", help="frontier time per page for its outlinks")
+    add_parser.add_argument("--pages", type=int, default=2000)
+    add_parser.add_argument("--links", type=int, default=60)
+    add_parser.add_argument("--flush_interval", type=float, default=1.0)
+    add_parser.set_defaults(func=bench_frontier_add)
+
+    resume_parser = subparsers.add_parser("resume", help="frontier startup time on an existing save file")
+    resume_parser.add_argument("--urls", type=int, default=1000000)
+    resume_parser.add_argument("--pending", type=float, default=0.05, help="fraction of urls not downloaded yet")
+    resume_parser.set_defaults(func=bench_resume)
+
+    metrics_parser = subparsers.add_parser("metrics", help="overhead of the stage timers per page")
+    metrics_parser.add_argument("--pages", type=int, default=100000)
+    metrics_parser.set_defaults(func=bench_metrics)
+
+    crawl_parser = subparsers.add_parser("crawl", help="end to end crawl of a synthetic web for several thread counts")
+    crawl_parser.add_argument("--threads", type=str, default="1,2,4,8", help="comma separated THREADCOUNT values")
+    crawl_parser.add_argument("--fetchers", type=int, default=0)
+    crawl_parser.add_argument("--parsers", type=int, default=0)
+    crawl_parser.add_argument("--simhash", action="store_true", default=False)
+    crawl_parser.add_argument("--latency", type=float, default=0.005, help="seconds the stub waits per request")
+    crawl_parser.add_argument("--politeness", type=float, default=0.0)
+    crawl_parser.add_argument("--pages", type=int, default=2000)
+    crawl_parser.add_argument("--hosts", type=int, default=20)
+    crawl_parser.add_argument("--fan_out", type=int, default=10)
+    crawl_parser.add_argument("--duplicates", type=float, default=0.05)
+    crawl_parser.add_argument("--redirects", type=float, default=0.05)
+    crawl_parser.add_argument("--non_html", type=float, default=0.05)
+    crawl_parser.add_argument("--traps", type=int, default=1)
+    crawl_parser.add_argument("--archives", type=int, default=0, help="hosts of low information archive pages")
+    crawl_parser.add_argument("--priority", type=str, default="yield", help="PRIORITY POLICY of the frontier")
+    crawl_parser.add_argument("--replay", type=str, default=None, help="cbor file of pages written by --record")
+    crawl_parser.add_argument("--seed_url", type=str, default="https://www.ics.uci.edu", help="seed url of --replay")
+    crawl_parser.add_argument("--record", type=str, default=None, help="write the pages served to this cbor file")
+    crawl_parser.add_argument("--output", type=str, default=None, help="append the results as json lines")
+    crawl_parser.set_defaults(func=bench_crawl)
+
+    simhash_parser = subparsers.add_parser("simhash", help="simhash fingerprint correctness and speed")
+    simhash_parser.add_argument("--pages", type=int, default=200)
+    simhash_parser.add_argument("--tokens", type=int, default=1000)
+    simhash_parser.set_defaults(func=bench_simhash)
+
+    index_parser = subparsers.add_parser("simhash-index", help="near duplicate lookup with the LSH index")
+    index_parser.add_argument("--fingerprints", type=int, default=100000)
+    index_parser.add_argument("--queries", type=int, default=1000)
+    index_parser.add_argument("--scan_queries", type=int, default=3)
+    index_parser.set_defaults(func=bench_simhash_index)
+
+    download_parser = subparsers.add_parser("download", help="cache server download throughput against a local stub")
+    download_parser.add_argument("--pages", type=int, default=2000)
+    download_parser.add_argument("--in_flight", type=int, default=8)
+    download_parser.add_argument("--queue_size", type=int, default=16)
+    download_parser.add_argument("--latency", type=float, default=0.002)
+    download_parser.set_defaults(func=bench_download)
+
+    parse_parser = subparsers.add_parser("parse", help="html parsing time, memory and equivalence")
+    parse_parser.add_argument("--corpus", type=str, default=None, help="directory of saved html pages")
+    parse_parser.add_argument("--pages", type=int, default=500, help="number of synthetic pages without --corpus")
+    parse_parser.add_argument("--memory_pages", type=int, default=50)
+    parse_parser.set_defaults(func=bench_parse)
+
+    filter_parser = subparsers.add_parser("url-filter", help="is_valid parity and speed")
+    filter_parser.add_argument("--urls", type=int, default=1000000)
+    filter_parser.set_defaults(func=bench_url_filter)
+
+    canonicalize_parser = subparsers.add_parser("canonicalize", help="duplicate urls collapsed by canonicalization")
+    canonicalize_parser.add_argument("--pages", type=int, default=100000)
+    canonicalize_parser.set_defaults(func=bench_canonicalize)
+
+    charset_parser = subparsers.add_parser("charset", help="charset resolution and lazy responses")
+    charset_parser.add_argument("--pages", type=int, default=2000)
+    charset_parser.add_argument("--ok_rate", type=float, default=0.7, help="share of responses with status 200")
+    charset_parser.set_defaults(func=bench_charset)
+
+    tokenize_parser = subparsers.add_parser("tokenize", help="word counting speed")
+    tokenize_parser.add_argument("--pages", type=int, default=50)
+    tokenize_parser.add_argument("--words", type=int, default=100000)
+    tokenize_parser.set_defaults(func=bench_tokenize)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -1,31 +1,95 @@
 from utils import get_logger
+from utils.url_filter import URLFilter
+from utils.canonicalize import Canonicalizer
+import scraper
 from crawler.frontier import Frontier
 from crawler.worker import Worker
 from crawler.simhash import SimHash
+from crawler.stats import CrawlStats
+from crawler.traps import TrapDetector
+from crawler.metrics import Metrics
+from crawler.fetcher import Fetcher
+from crawler.page_store import PageStore
+from queue import Queue
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 class Crawler(object):
     def __init__(self, config, restart, frontier_factory=Frontier, worker_factory=Worker, simhash_factory=SimHash, pickle_file_prefix="stats"):
         self.config = config
         self.logger = get_logger("CRAWLER")
-        self.frontier = frontier_factory(config, restart)
+        scraper.url_filter = URLFilter(scraper.domains, config.trap_rules)
+        scraper.canonicalizer = Canonicalizer(config.canonical_rules, config.strip_params)
+        self.traps = TrapDetector(
+            config.trap_file, config.trap_max_depth, config.trap_max_repeats, config.trap_query_variants,
+            config.trap_date_urls, config.trap_duplicate_rate, config.trap_duplicate_samples)
+        self.frontier = frontier_factory(config, restart, self.traps)
         self.simhash = simhash_factory(config, restart) if config.simhash_file is not None else None
         self.pickle_file_prefix = pickle_file_prefix
+        # statistics of all workers, merged into one stats file and one report.
+        self.stats = CrawlStats(
+            f"{pickle_file_prefix}.pickle", restart, config.stats_checkpoint_pages, config.stats_checkpoint_interval)
+        self.report_file = "report.txt"
+        self.metrics = Metrics(config.metrics_file, config.metrics_interval)
+        # downloaded responses, kept to scrape them again with crawler.reprocess.Reprocessor
+        self.pages = PageStore(config.page_store, restart) if config.page_store is not None else None
         self.workers = list()
+        self.fetchers = list()
+        # parser processes shared by the workers, the main process keeps the frontier, simhash and stats.
+        # They are started by a fork server: forking this process would copy the locks its threads hold.
+        self.parsers = ProcessPoolExecutor(
+            config.parsers_count, mp_context=multiprocessing.get_context("forkserver")
+        ) if config.parsers_count > 0 else None
         self.worker_factory = worker_factory
         self.restart = restart
 
     def start_async(self):
+        downloads = None
+        if self.config.fetchers_count > 0:
+            # pipeline mode: fetchers download into a bounded queue, workers only scrape.
+            downloads = Queue(maxsize=self.config.download_queue_size)
+            self.fetchers = [
+                Fetcher(fetcher_id, self.config, self.frontier, downloads, self.metrics)
+                for fetcher_id in range(self.config.fetchers_count)]
         self.workers = [
-            self.worker_factory(worker_id, self.config, self.frontier, self.simhash, self.restart)
+            self.worker_factory(
+                worker_id, self.config, self.frontier, self.simhash, self.stats, downloads, self.parsers, self.traps,
+                self.metrics, self.pages)
             for worker_id in range(self.config.threads_count)]
-        for worker in self.workers:
-            worker.start()
+        self.metrics.start()
+        for thread in self.fetchers + self.workers:
+            thread.start()
 
     def start(self):
         try:
             self.start_async()
         finally:
-            self.join()
+            try:
+                self.join()
+            finally:
+                self.close()
 
     def join(self):
+        for fetcher in self.fetchers:
+            fetcher.join()
+        if self.fetchers:
+            # every fetcher stopped, so nothing more will be downloaded: stop the workers.
+            for worker in self.workers:
+                worker.downloads.put((None, None))
         for worker in self.workers:
             worker.join()
+
+    def close(self):
+        if self.parsers is not None:
+            self.parsers.shutdown()
+        # flushes the stats and frontier writes that are still buffered.
+        self.stats.close()
+        self.stats.write_report(self.report_file)
+        # syncs the fingerprints of the pages stored since the last sync
+        if self.simhash is not None:
+            self.simhash.save.close()
+        self.traps.close()
+        self.logger.info(scraper.canonicalizer.summary())
+        self.metrics.close()
+        if self.pages is not None:
+            self.pages.close()
+        self.frontier.close()
@@ -0,0 +1,43 @@
+import time
+
+from threading import Thread
+from urllib.parse import urlparse
+
+from utils.download import download
+from utils import get_logger
+from crawler.metrics import Metrics
+
+
+class Fetcher(Thread):
+    """
+    Download stage of the pipeline mode: takes urls from the frontier, downloads them through the
+    cache server and puts (url, resp) into the bounded `downloads` queue the workers scrape from.
+    A full queue blocks the fetcher, so downloads never run further ahead of scraping than its size.
+    """
+    def __init__(self, fetcher_id, config, frontier, downloads, metrics=None):
+        self.logger = get_logger(f"Fetcher-{fetcher_id}", "Fetcher")
+        self.config = config
+        self.frontier = frontier
+        self.downloads = downloads
+        self.metrics = metrics if metrics is not None else Metrics()
+        super().__init__(daemon=True)
+
+    def run(self):
+        while True:
+            start = time.perf_counter()
+            tbd_url = self.frontier.get_tbd_url()
+            self.metrics.observe("frontier get", start)
+            if not tbd_url:
+                self.logger.info("Frontier is empty. Stopping Fetcher.")
+                break
+            start = time.perf_counter()
+            try:
+                resp = download(tbd_url, self.config, self.logger)
+                self.metrics.observe("download", start)
+                self.metrics.fetched(urlparse(tbd_url).hostname, resp.status)
+            except Exception as err:
+                self.logger.error(f"Failed to download {tbd_url}: {err}")
+                self.metrics.count("download errors")
+                resp = None
+            # the worker marks tbd_url complete, also when the download failed.
+            self.downloads.put((tbd_url, resp))
@@ -1,18 +1,57 @@
 import os
-import shelve
+import time
+import heapq
+import shutil
 
-from threading import Thread, RLock
+from threading import Thread, RLock, Condition
 from queue import Queue, Empty
+from hashlib import blake2b
+from itertools import count
+from urllib.parse import urlparse
 
-from utils import get_logger, get_urlhash, normalize
-from scraper import is_valid
+from utils import get_logger, get_urlhash
+from scraper import is_valid, canonicalize
+from crawler.store import FrontierStore
+from crawler.seen import SeenIndex
+from crawler.host_queue import HostQueue
+from crawler.priority import make_policy
 
 class Frontier(object):
-    def __init__(self, config, restart):
+    def __init__(self, config, restart, traps=None, policy=None):
         self.logger = get_logger("FRONTIER")
         self.config = config
-        self.to_be_downloaded = list()
-        
+        # crawler.traps.TrapDetector deciding which new urls are queued, None to queue every url.
+        self.traps = traps
+        # scores the queued urls, see crawler/priority.py. The policy of config.priority_policy if None.
+        self.policy = policy if policy is not None else make_policy(config)
+        self.lock = RLock()
+        self.has_work = Condition(self.lock)
+        # host -> HostQueue of urls waiting to be downloaded from that host.
+        self.host_queues = dict()
+        # host -> earliest time (time.monotonic()) the host may be fetched again.
+        self.next_fetch_time = dict()
+        # heap of (next_fetch_time, host) for hosts that have urls queued and no download in flight.
+        self.ready_hosts = []
+        # heap of (-score of the best url, sequence, host) for the ready hosts whose next_fetch_time passed.
+        self.due_hosts = []
+        self.sequence = count()
+        # url -> link depth of the urls handed out by get_tbd_url, their outlinks are one deeper.
+        self.depths = dict()
+        # hosts that currently have a download in flight. They are rescheduled on mark_url_complete.
+        self.busy_hosts = set()
+        # number of urls handed out by get_tbd_url that are not marked complete yet.
+        self.in_flight = 0
+        # hashes of urls completed as the target of a redirect, get_tbd_url skips them if they are queued.
+        # Only needed for this run: the targets are saved as completed, so a resume does not queue them.
+        self.redirect_targets = set()
+        # answers "already seen" for add_url without a lookup in the save file, once seen_complete is set.
+        self.seen = SeenIndex()
+        self.seen_complete = True
+        # set while the save file is loaded in the background, get_tbd_url does not give up meanwhile.
+        self.loading = False
+        self.loader = None
+        self.stop_loading = False
+
         if not os.path.exists(self.config.save_file) and not restart:
             # Save file does not exist, but request to load save.
             self.logger.info(
@@ -22,41 +61,145 @@ class Frontier(object):
             # Save file does exists, but request to start from seed.
             self.logger.info(
                 f"Found save file {self.config.save_file}, deleting it.")
-            os.remove(self.config.save_file)
+            FrontierStore.remove(self.config.save_file)
+        # The spilled queue segments only mirror the pending urls of the save file, start them from scratch.
+        shutil.rmtree(self.config.spill_dir, ignore_errors=True)
+        os.makedirs(self.config.spill_dir)
         # Load existing save file, or create one if it does not exist.
-        self.save = shelve.open(self.config.save_file)
-        if restart:
+        self.save = FrontierStore(self.config.save_file, self.config.flush_interval)
+        if restart or not self.save:
             for url in self.config.seed_urls:
                 self.add_url(url)
         else:
-            # Set the frontier state with contents of save file.
-            self._parse_save_file()
-            if not self.save:
-                for url in self.config.seed_urls:
-                    self.add_url(url)
+            # Set the frontier state with contents of save file, in the background so workers start at once.
+            self.loading = True
+            self.seen_complete = False
+            self.loader = Thread(target=self._parse_save_file, name="FrontierLoader", daemon=True)
+            self.loader.start()
 
     def _parse_save_file(self):
-        ''' This function can be overridden for alternate saving techniques. '''
-        total_count = len(self.save)
+        '''
+        Stream the pending urls of the save file into the host queues, then the hashes of every saved url into
+        the seen index. Until the seen index is complete, add_url looks urls up in the save file.
+        This function can be overridden for alternate saving techniques.
+        '''
+        start = time.perf_counter()
         tbd_count = 0
-        for url, completed in self.save.values():
-            if not completed and is_valid(url):
-                self.to_be_downloaded.append(url)
-                tbd_count += 1
+        for rows in self.save.pending():
+            with self.lock:
+                if self.stop_loading:
+                    return
+                for urlhash, url in rows:
+                    # urls added by workers meanwhile are queued already.
+                    if urlhash not in self.seen:
+                        self.seen.add(urlhash)
+                        if is_valid(url):
+                            # the depth of a saved url is not kept
+                            self._enqueue(url, None)
+                            tbd_count += 1
+        with self.lock:
+            self.loading = False
+            self.has_work.notify_all()
+        self.logger.info(
+            f"Found {tbd_count} urls to be downloaded in {time.perf_counter() - start:.2f}s.")
+
+        total_count = 0
+        for rows in self.save.hashes():
+            with self.lock:
+                if self.stop_loading:
+                    return
+                for urlhash, in rows:
+                    self.seen.add(urlhash)
+                total_count += len(rows)
+        self.seen_complete = True
         self.logger.info(
-            f"Found {tbd_count} urls to be downloaded from {total_count} "
-            f"total urls discovered.")
+            f"Indexed {total_count} total urls discovered in {time.perf_counter() - start:.2f}s.")
+
+    @staticmethod
+    def _get_host(url):
+        return urlparse(url).hostname or ""
+
+    def _enqueue(self, url, depth):
+        """ Append url to its host queue and schedule the host if it is idle. Caller holds the lock. """
+        host = self._get_host(url)
+        queue = self.host_queues.get(host)
+        if queue is None:
+            name = blake2b(host.encode("utf-8"), digest_size=8).hexdigest()
+            queue = self.host_queues[host] = HostQueue(
+                self.config.spill_dir, name, self.config.queue_head_size, self.policy)
+        queue.append(url, depth)
+        if len(queue) == 1 and host not in self.busy_hosts:
+            heapq.heappush(self.ready_hosts, (self.next_fetch_time.get(host, 0), host))
+        self.has_work.notify()
 
     def get_tbd_url(self):
-        try:
-            return self.to_be_downloaded.pop()
-        except IndexError:
-            return None
+        """
+        Get one url whose host may be fetched now without breaking politeness: the best scored url of
+        the due host with the best scored url. Host scores are checked again when the host comes out of
+        the heap, like the url scores in HostQueue.pop.
+        Blocks while every queued host is still cooling down, or while the queues are empty
+        but other workers have downloads in flight that may add new urls.
+
+        Returns
+        -------
+        str or None
+            None when there is nothing left to download and nothing in flight.
+        """
+        with self.has_work:
+            while True:
+                now = time.monotonic()
+                while self.ready_hosts and self.ready_hosts[0][0] <= now:
+                    _, host = heapq.heappop(self.ready_hosts)
+                    self._make_due(host, next(self.sequence))
+                if self.due_hosts:
+                    negative_score, sequence, host = heapq.heappop(self.due_hosts)
+                    queue = self.host_queues[host]
+                    score = queue.best()
+                    if self.due_hosts and score < -negative_score and score < -self.due_hosts[0][0]:
+                        # the best url of the host scores lower than when the host became due
+                        heapq.heappush(self.due_hosts, (-score, sequence, host))
+                        continue
+                    url, depth = queue.pop()
+                    if not queue:
+                        queue.clear()
+                        del self.host_queues[host]
+                    if self._skip(url):
+                        if host in self.host_queues:
+                            self._make_due(host, sequence)
+                        continue
+                    self.busy_hosts.add(host)
+                    self.in_flight += 1
+                    self.depths[url] = depth
+                    return url
+                elif self.ready_hosts:
+                    self.has_work.wait(self.ready_hosts[0][0] - now)
+                elif self.in_flight > 0 or self.loading:
+                    self.has_work.wait()
+                else:
+                    # wake up the other waiting workers so they can stop as well.
+                    self.has_work.notify_all()
+                    return None
+
+    def _make_due(self, host, sequence):
+        """ Move host, whose politeness delay passed, to the due hosts. Caller holds the lock. """
+        heapq.heappush(self.due_hosts, (-self.host_queues[host].best(), sequence, host))
+
+    def _skip(self, url):
+        """ Whether a queued url is complete without a download. Caller holds the lock. """
+        urlhash = get_urlhash(url)
+        if urlhash in self.redirect_targets:
+            # downloaded already as the target of a redirect.
+            return True
+        if self.traps is not None and self.traps.is_blocked(url):
+            # its pattern was blocked after it was queued.
+            self.save[urlhash] = (url, True)
+            return True
+        return False
 
     def add_url(self, url):
         """
-        If url not in shelve, save url to shelve as incomplete, and add url to "To Be Downloaded" queue.
-        If url is already in shelve, do nothing.
+        If url not in the save file, save url as incomplete, and add url to "To Be Downloaded" queue.
+        If url is already in the save file, do nothing.
         Parameters
         ----------
         url: str
@@ -65,19 +208,142 @@ class Frontier(object):
         -------
         None
         """
-        url = normalize(url)
-        urlhash = get_urlhash(url)
-        if urlhash not in self.save:
-            self.save[urlhash] = (url, False)
-            self.save.sync()
-            self.to_be_downloaded.append(url)
-    
+        self.add_urls([url])
+
+    def add_urls(self, urls, source=None):
+        """
+        add_url for every url of urls, e.g. the outlinks of one page. The urls are deduplicated, canonicalized
+        and hashed before the lock is taken, then looked up in one pass and saved with one write to the save file.
+        Parameters
+        ----------
+        urls: iterable of str
+        source: str
+            the url the urls were scraped from, they are one link deeper. None for seeds.
+
+        Returns
+        -------
+        int
+            the number of new urls queued.
+        """
+        hashed = dict()
+        # a page links the same url several times, canonicalize and hash every spelling once.
+        for url in dict.fromkeys(urls):
+            url = canonicalize(url)
+            hashed.setdefault(get_urlhash(url), url)
+        with self.lock:
+            depth = 0 if source is None else self._depth(source)
+            new = [urlhash for urlhash in hashed if urlhash not in self.seen]
+            if new and not self.seen_complete:
+                # until the seen index is loaded, a url may be a saved one. Pending saved urls are
+                # queued by the loader, which skips the urls added here.
+                saved = self.save.existing(new)
+                new = [urlhash for urlhash in new if urlhash not in saved]
+            records = dict()
+            for urlhash in new:
+                url = hashed[urlhash]
+                self.seen.add(urlhash)
+                if self.traps is not None and not self.traps.admit(url):
+                    continue
+                records[urlhash] = (url, False)
+                self._enqueue(url, depth)
+            if records:
+                self.save.update(records)
+        return len(records)
+
+    def _depth(self, source):
+        """ Link depth of the urls scraped from source, None if it is unknown. Caller holds the lock. """
+        depth = self.depths.get(source)
+        return None if depth is None else depth + 1
+
+    def record_page(self, url, useful):
+        """
+        Tell the priority policy whether the download of url was useful, i.e. its page passed min_token
+        and the simhash check. Called for every url handed out by get_tbd_url, before mark_url_complete.
+        The queue of the host is rescored, the yields of its prefixes changed in either direction. Other
+        hosts only see the yield of the whole crawl move a little, their stale scores are caught lazily.
+        """
+        with self.lock:
+            self.policy.record_page(url, useful)
+            queue = self.host_queues.get(self._get_host(url))
+            if queue is not None:
+                queue.rescore()
+
+    def add_redirect(self, url, target, fetched=True):
+        """
+        Record that url redirects to target.
+        Parameters
+        ----------
+        url: str
+            the url that was downloaded.
+        target: str
+            the url it redirected to.
+        fetched: bool
+            whether the response of url holds the page of target (the redirect was followed). target is
+            marked complete then, so it is not downloaded again. Otherwise target is added like a scraped url.
+
+        Returns
+        -------
+        bool
+            False if the page of target was downloaded before, so the response of url needs no scraping.
+        """
+        target = canonicalize(target)
+        urlhash, target_hash = get_urlhash(url), get_urlhash(target)
+        if urlhash == target_hash:
+            # e.g. http to https, or a trailing slash
+            return True
+        with self.lock:
+            if not fetched:
+                if is_valid(target):
+                    # one link deeper than url, like a link on its page
+                    self.add_urls([target], source=url)
+                return True
+            try:
+                _, completed = self.save[target_hash]
+            except KeyError:
+                completed = False
+            if completed:
+                return False
+            self.seen.add(target_hash)
+            self.save[target_hash] = (target, True)
+            self.redirect_targets.add(target_hash)
+            return True
+
     def mark_url_complete(self, url):
         urlhash = get_urlhash(url)
-        if urlhash not in self.save:
-            # This should not happen.
-            self.logger.error(
-                f"Completed url {url}, but have not seen it before.")
+        with self.lock:
+            try:
+                if urlhash not in self.seen:
+                    # This should not happen.
+                    self.logger.error(
+                        f"Completed url {url}, but have not seen it before.")
+
+                self.save[urlhash] = (url, True)
+            finally:
+                self._release(url)
+
+    def _release(self, url):
+        """ Finish the in-flight download of url and start the politeness delay of its host. Caller holds the lock. """
+        host = self._get_host(url)
+        self.depths.pop(url, None)
+        if host not in self.busy_hosts:
+            return
+        self.busy_hosts.discard(host)
+        self.in_flight -= 1
+        self.next_fetch_time[host] = time.monotonic() + self.config.time_delay
+        if host in self.host_queues:
+            heapq.heappush(self.ready_hosts, (self.next_fetch_time[host], host))
+        self.has_work.notify_all()
 
-        self.save[urlhash] = (url, True)
-        self.save.sync()
+    def close(self):
+        if self.loader is not None:
+            with self.lock:
+                self.stop_loading = True
+            self.loader.join()
+        with self.lock:
+            try:
+                self.save.close()
+            except ValueError:
+                # closing an already closed save file raises ValueError
+                pass
+            for queue in self.host_queues.values():
+                queue.clear()
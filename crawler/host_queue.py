@@ -0,0 +1,131 @@
+import os
+import heapq
+
+from itertools import count
+from collections import deque
+
+from crawler.priority import LifoPolicy
+
+
+class HostQueue(object):
+    """
+    Urls waiting to be downloaded from one host, with their link depth (None if unknown).
+
+    At most `head_size` urls are kept in memory at the head of the queue. The head groups them by
+    `policy.group()`, the urls of a group always score the same, and hands out the newest url of the
+    group with the best score. The groups are kept in a heap ordered by the score `policy` gave them
+    when they were created, newest group first among equal scores. Once the head is full, new urls
+    are buffered in a tail of up to `head_size` urls that is written to an append-only segment file
+    in `spill_dir` when it fills up. Segments are read back lazily, oldest first, as the head drains.
+    Spilled urls are only a cache of the pending urls in the save file, which is what a resume reads.
+
+    Scores change as the policy learns. The frontier calls rescore() when the policy learned about the
+    host, which scores every group again, and pop() rescores the top group and puts it back if it fell
+    below the next one. A group holds every url of a host prefix and depth, so an update of the policy
+    costs at most one O(log n) heap operation per group, however many urls the group holds.
+    """
+    def __init__(self, spill_dir, name, head_size, policy=None):
+        self.spill_dir = spill_dir
+        self.name = name
+        self.head_size = head_size
+        self.policy = policy if policy is not None else LifoPolicy()
+        # group -> [(url, depth)] of the head, newest last
+        self.groups = dict()
+        # heap of (-score, -sequence, group), one entry per group of self.groups
+        self.head = []
+        self.head_count = 0
+        self.sequence = count()
+        # (url, depth) waiting to be spilled
+        self.tail = []
+        # paths of the segment files not read back yet, oldest first
+        self.segments = deque()
+        self.segment_count = 0
+        self.spilled = 0
+
+    def __len__(self):
+        return self.head_count + len(self.tail) + self.spilled
+
+    def append(self, url, depth=None):
+        if self.head_count < self.head_size and not self.segments and not self.tail:
+            self._push(url, depth)
+            return
+        self.tail.append((url, depth))
+        if len(self.tail) >= self.head_size:
+            self._spill()
+
+    def _push(self, url, depth):
+        group = self.policy.group(url, depth)
+        urls = self.groups.get(group)
+        if urls is None:
+            urls = self.groups[group] = []
+            heapq.heappush(self.head, (-self.policy.score(url, depth), -next(self.sequence), group))
+        urls.append((url, depth))
+        self.head_count += 1
+
+    def _score(self, group):
+        return self.policy.score(*self.groups[group][-1])
+
+    def best(self):
+        """ Current score of the url pop() returns next, unless a rescored group overtakes it. """
+        if not self.head:
+            self._refill()
+        return self._score(self.head[0][2])
+
+    def rescore(self):
+        """ Score every group of the head again, e.g. once a download raised the yield of a prefix. """
+        self.head = [(-self._score(group), sequence, group) for _, sequence, group in self.head]
+        heapq.heapify(self.head)
+
+    def pop(self):
+        """ The (url, depth) with the highest score. """
+        if not self.head:
+            self._refill()
+        while True:
+            negative_score, sequence, group = self.head[0]
+            score = self._score(group)
+            if len(self.head) > 1 and score < -negative_score and score < -min(self.head[1:3])[0]:
+                # the score dropped below the next group since it was pushed
+                heapq.heapreplace(self.head, (-score, sequence, group))
+                continue
+            urls = self.groups[group]
+            url, depth = urls.pop()
+            self.head_count -= 1
+            if not urls:
+                heapq.heappop(self.head)
+                del self.groups[group]
+            return url, depth
+
+    def _spill(self):
+        path = os.path.join(self.spill_dir, f"{self.name}-{self.segment_count}.seg")
+        self.segment_count += 1
+        with open(path, 'w', encoding="utf-8") as file:
+            file.write("\n".join(f"{'' if depth is None else depth} {url}" for url, depth in self.tail))
+        self.segments.append(path)
+        self.spilled += len(self.tail)
+        self.tail = []
+
+    def _refill(self):
+        if self.segments:
+            path = self.segments.popleft()
+            with open(path, encoding="utf-8") as file:
+                lines = file.read().split("\n")
+            os.remove(path)
+            self.spilled -= len(lines)
+            for line in lines:
+                depth, url = line.split(" ", 1)
+                self._push(url, int(depth) if depth else None)
+        else:
+            for url, depth in self.tail:
+                self._push(url, depth)
+            self.tail = []
+
+    def clear(self):
+        """ Delete the segment files of the queue. """
+        for path in self.segments:
+            os.remove(path)
+        self.segments.clear()
+        self.groups.clear()
+        self.head.clear()
+        self.head_count = 0
+        self.tail = []
+        self.spilled = 0
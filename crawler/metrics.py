@@ -0,0 +1,138 @@
+import json
+import time
+
+from bisect import bisect_left
+from collections import Counter
+from threading import Thread, Lock, Event
+
+from utils import get_logger
+
+
+class Histogram(object):
+    """ Latencies in seconds, counted in buckets with upper bounds doubling from 100 us to about 100 s. """
+    bounds = [0.0001 * 2 ** i for i in range(21)]
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        # the last bucket counts everything above the last bound
+        self.buckets = [0] * (len(self.bounds) + 1)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.buckets[bisect_left(self.bounds, seconds)] += 1
+
+    def quantile(self, q):
+        """ Upper bound of the bucket holding the q quantile, max for the last bucket. """
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count, "sum": round(self.total, 6),
+            "mean": round(self.total / self.count, 6) if self.count else 0.0,
+            "p50": round(self.quantile(0.5), 6), "p90": round(self.quantile(0.9), 6),
+            "p99": round(self.quantile(0.99), 6), "max": round(self.max, 6)}
+
+
+class Metrics(object):
+    """
+    Per-stage latency histograms, counters and per-host fetch counts shared by the crawler threads.
+
+    Threads time a stage with `start = time.perf_counter()` ... `metrics.observe(stage, start)`, and count
+    events with `metrics.count(name)`. Both only take a lock and update a few numbers. A reporter thread
+    started by start() logs a summary every `interval` seconds, and appends a snapshot as one json line to
+    `metrics_file` if it is set. close() stops it and emits a last snapshot.
+    """
+    def __init__(self, metrics_file=None, interval=60.0):
+        self.logger = get_logger("METRICS")
+        self.metrics_file = metrics_file
+        self.interval = interval
+        self.lock = Lock()
+        self.started = time.time()
+        self.stages = dict()
+        self.counters = Counter()
+        self.hosts = Counter()
+        self.last_pages = 0
+        self.last_emit = time.monotonic()
+        self.stopped = Event()
+        self.reporter = None
+
+    def observe(self, stage, start):
+        """ Record the time since start, a time.perf_counter() value, for stage. """
+        self.record(stage, time.perf_counter() - start)
+
+    def record(self, stage, seconds):
+        """ Record seconds for stage, e.g. a time measured in a parser process. """
+        with self.lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def fetched(self, host, status):
+        """ Count a download from host and its status. """
+        with self.lock:
+            self.hosts[host] += 1
+            self.counters["fetched"] += 1
+            if status != 200:
+                self.counters[f"status {status}"] += 1
+
+    def snapshot(self):
+        with self.lock:
+            now = time.monotonic()
+            pages = self.counters["pages"]
+            elapsed = now - self.last_emit
+            snapshot = {
+                "time": round(time.time(), 3),
+                "uptime": round(time.time() - self.started, 3),
+                "pages_per_sec": round((pages - self.last_pages) / elapsed, 3) if elapsed > 0 else 0.0,
+                "counters": dict(self.counters),
+                "stages": {stage: histogram.summary() for stage, histogram in self.stages.items()},
+                "hosts": dict(self.hosts)}
+            self.last_pages = pages
+            self.last_emit = now
+        return snapshot
+
+    def emit(self):
+        snapshot = self.snapshot()
+        stages = ", ".join(
+            f"{stage} {summary['count']}x {summary['mean'] * 1000:.1f}/{summary['p99'] * 1000:.1f} ms"
+            for stage, summary in snapshot["stages"].items())
+        self.logger.info(
+            f"{snapshot['pages_per_sec']:.2f} pages/sec, {snapshot['counters'].get('pages', 0)} pages, "
+            f"{len(snapshot['hosts'])} hosts. Stage mean/p99: {stages or 'none'}")
+        if self.metrics_file is not None:
+            with open(self.metrics_file, 'a', encoding="utf-8") as file:
+                file.write(json.dumps(snapshot) + "\n")
+
+    def _report(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.emit()
+            except Exception as err:
+                self.logger.error(f"Failed to emit metrics: {err}")
+
+    def start(self):
+        self.reporter = Thread(target=self._report, name="Metrics", daemon=True)
+        self.reporter.start()
+
+    def close(self):
+        if self.reporter is not None:
+            self.stopped.set()
+            self.reporter.join()
+            self.reporter = None
+        self.emit()
@@ -0,0 +1,134 @@
+import os
+import mmap
+import zlib
+import shutil
+
+import cbor
+
+from threading import RLock
+
+from utils import get_logger, get_urlhash
+from utils.response import Response
+
+
+class PageStore(object):
+    """
+    Append-only store of the downloaded responses, so pages can be scraped again without the cache server.
+
+    Every response is appended to the current segment file `pages-<n>.seg` in `directory` as the zlib
+    compressed cbor of the cache server payload (url, status, error and the pickled requests response).
+    A new segment is started once the current one is `segment_size` bytes. After the record is written,
+    a line "<urlhash> <segment> <offset> <length>" is appended to the `index` file, which is read into
+    memory when the store is opened. A url downloaded again replaces its index entry, a record without
+    an index line (the crawler was killed while writing it) is never read. Segments are read through
+    read only memory maps.
+    """
+    def __init__(self, directory, restart, segment_size=64 * 1024 * 1024, level=6):
+        self.logger = get_logger("PAGESTORE")
+        self.directory = directory
+        self.segment_size = segment_size
+        self.level = level
+        if restart and os.path.exists(directory):
+            self.logger.info(f"Found page store {directory}, deleting it.")
+            shutil.rmtree(directory)
+        os.makedirs(directory, exist_ok=True)
+        self.lock = RLock()
+        # urlhash -> (segment, offset, length)
+        self.index = dict()
+        self.index_path = os.path.join(directory, "index")
+        if os.path.exists(self.index_path):
+            self._load_index()
+        self.segment = max((segment for segment, _, _ in self.index.values()), default=0)
+        self.file = open(self._segment_path(self.segment), 'ab')
+        self.index_file = open(self.index_path, 'a', encoding="utf-8")
+        # segment -> mmap.mmap, remapped when a read goes past the end of the mapped segment.
+        self.maps = dict()
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, f"pages-{segment}.seg")
+
+    def _load_index(self):
+        with open(self.index_path, encoding="utf-8") as file:
+            for line in file:
+                fields = line.split()
+                # the last line is cut short if the crawler was killed while writing it.
+                if len(fields) == 4 and line.endswith("\n"):
+                    self.index[fields[0]] = (int(fields[1]), int(fields[2]), int(fields[3]))
+        self.logger.info(f"Indexed {len(self.index)} stored pages.")
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, url):
+        return get_urlhash(url) in self.index
+
+    def append(self, url, resp):
+        """ Store resp, the utils.response.Response downloaded for url. """
+        payload = {"url": resp.url, "status": resp.status}
+        if resp.error is not None:
+            payload["error"] = resp.error
+        if resp.pickled_response is not None:
+            payload["response"] = resp.pickled_response
+        record = zlib.compress(cbor.dumps(payload), self.level)
+        urlhash = get_urlhash(url)
+        with self.lock:
+            if self.file.tell() >= self.segment_size:
+                self.file.close()
+                self.segment += 1
+                self.file = open(self._segment_path(self.segment), 'ab')
+            offset = self.file.tell()
+            self.file.write(record)
+            # the record reaches the file before its index line, and the index line before the next record,
+            # so a killed crawler loses at most the record it was writing.
+            self.file.flush()
+            self.index[urlhash] = (self.segment, offset, len(record))
+            self.index_file.write(f"{urlhash} {self.segment} {offset} {len(record)}\n")
+            self.index_file.flush()
+
+    def _read(self, segment, offset, length):
+        """ Record bytes out of the memory map of segment. Caller holds the lock. """
+        segment_map = self.maps.get(segment)
+        if segment_map is None or offset + length > len(segment_map):
+            if segment == self.segment:
+                # the record may still be in the write buffer
+                self.file.flush()
+            if segment_map is not None:
+                segment_map.close()
+            with open(self._segment_path(segment), 'rb') as file:
+                segment_map = self.maps[segment] = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return segment_map[offset:offset + length]
+
+    def get(self, url):
+        """ The stored utils.response.Response of url, None if it was not stored. """
+        with self.lock:
+            location = self.index.get(get_urlhash(url))
+            if location is None:
+                return None
+            record = self._read(*location)
+        return Response(cbor.loads(zlib.decompress(record)))
+
+    def __iter__(self):
+        """
+        (url, utils.response.Response) of every stored page, in the order the records are in the segments,
+        so the segments are read sequentially. Pages stored while iterating are not included.
+        """
+        with self.lock:
+            locations = sorted(self.index.values())
+        for location in locations:
+            with self.lock:
+                record = self._read(*location)
+            resp = Response(cbor.loads(zlib.decompress(record)))
+            yield resp.url, resp
+
+    def flush(self):
+        with self.lock:
+            self.file.flush()
+            self.index_file.flush()
+
+    def close(self):
+        with self.lock:
+            for segment_map in self.maps.values():
+                segment_map.close()
+            self.maps.clear()
+            self.file.close()
+            self.index_file.close()
@@ -0,0 +1,93 @@
+from functools import lru_cache
+from collections import Counter
+from urllib.parse import urlparse
+
+
+class LifoPolicy(object):
+    """
+    Every url scores the same, so each host queue hands out its newest url first (the queues break ties
+    by recency), and due hosts are served in the order they became due. The order before priorities.
+    """
+    def __init__(self, config=None):
+        pass
+
+    def score(self, url, depth):
+        return 0.0
+
+    def group(self, url, depth):
+        return None
+
+    def record_page(self, url, useful):
+        pass
+
+
+class YieldPolicy(object):
+    """
+    Scores urls by the observed yield of their host and path prefix, the novelty of their host and
+    their depth, so the pages that pass min_token and the simhash check are reached with fewer requests.
+
+    The yield of a prefix (host and first path segment) is the fraction of its downloaded pages that
+    were useful, smoothed towards the yield of its host with weight `smoothing`, which is smoothed towards
+    the yield of the whole crawl the same way, so a prefix without downloads scores like its host.
+    Hosts with few downloads get a novelty bonus of `novelty_weight` / (1 + downloads / novelty_pages).
+    Every link from the seeds divides the score by 1 + `depth_weight`, urls of unknown depth (loaded
+    from the save file on resume) count as depth 1.
+
+    score = yield * (1 + novelty) / (1 + depth_weight) ** depth
+
+    The urls of one prefix and depth score the same, they form one group of a host queue. record_page()
+    only updates the counters of one host and prefix. Queued urls are not rescored then, the frontier
+    rescores a group when it reaches the top of its queue instead.
+    """
+    def __init__(self, config=None, depth_weight=0.1, novelty_weight=1.0, novelty_pages=20, smoothing=2.0):
+        if config is not None:
+            depth_weight = config.priority_depth_weight
+            novelty_weight = config.priority_novelty_weight
+        self.depth_weight = depth_weight
+        self.novelty_weight = novelty_weight
+        self.novelty_pages = novelty_pages
+        self.smoothing = smoothing
+        # host or (host, first path segment) -> downloaded pages, and how many of them were useful
+        self.downloaded = Counter()
+        self.useful = Counter()
+        self.total_downloaded = 0
+        self.total_useful = 0
+
+    @staticmethod
+    @lru_cache(maxsize=4096)
+    def _keys(url):
+        # cached: a url is scored again when it reaches the top of its queue and when it is popped
+        parsed = urlparse(url)
+        host = parsed.hostname or ""
+        return host, (host, parsed.path.strip("/").split("/", 1)[0])
+
+    def _smoothed(self, key, prior):
+        return (self.useful[key] + self.smoothing * prior) / (self.downloaded[key] + self.smoothing)
+
+    def score(self, url, depth):
+        host, prefix = self._keys(url)
+        crawl_yield = (self.total_useful + 1) / (self.total_downloaded + 2)
+        prefix_yield = self._smoothed(prefix, self._smoothed(host, crawl_yield))
+        novelty = self.novelty_weight / (1 + self.downloaded[host] / self.novelty_pages)
+        return prefix_yield * (1 + novelty) / (1 + self.depth_weight) ** (1 if depth is None else depth)
+
+    def group(self, url, depth):
+        """ Key shared by the urls that always score the same as url. """
+        return self._keys(url)[1], depth
+
+    def record_page(self, url, useful):
+        """ Count a downloaded url, useful if its page passed min_token and the simhash check. """
+        for key in self._keys(url):
+            self.downloaded[key] += 1
+            self.useful[key] += bool(useful)
+        self.total_downloaded += 1
+        self.total_useful += bool(useful)
+
+
+PRIORITY_POLICIES = {"lifo": LifoPolicy, "yield": YieldPolicy}
+
+
+def make_policy(config):
+    """ The priority policy named by config.priority_policy. """
+    assert config.priority_policy in PRIORITY_POLICIES, f"Unknown priority policy {config.priority_policy}"
+    return PRIORITY_POLICIES[config.priority_policy](config)
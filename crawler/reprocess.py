@@ -0,0 +1,104 @@
+import time
+
+import multiprocessing
+
+from threading import Thread, Lock
+from concurrent.futures import ProcessPoolExecutor
+
+from utils import get_logger
+from utils.url_filter import URLFilter
+from utils.canonicalize import Canonicalizer
+import scraper
+from crawler.worker import Worker
+from crawler.simhash import SimHash
+from crawler.stats import CrawlStats
+from crawler.traps import TrapDetector
+from crawler.metrics import Metrics
+from crawler.page_store import PageStore
+
+
+class Reprocessor(object):
+    """
+    Scrapes the pages of the page store again through scraper.scraper, without the cache server, to rebuild
+    the stats, report and simhash fingerprints after the tokenizer, trap rules or simhash threshold changed.
+
+    THREADCOUNT threads (and PARSERS processes) scrape the stored pages in the order they are stored in.
+    The stats and simhash files are rebuilt from scratch, the frontier is not touched and the scraped
+    links are only counted. The trap detector starts without the decisions of the crawl and does not
+    save its own, its decisions on the near duplicate pages are logged.
+    """
+    def __init__(self, config, worker_factory=Worker, simhash_factory=SimHash, pickle_file_prefix="stats"):
+        self.config = config
+        self.logger = get_logger("REPROCESS")
+        assert config.page_store is not None, "Set PAGESTORE in the config to store the pages to reprocess"
+        scraper.url_filter = URLFilter(scraper.domains, config.trap_rules)
+        scraper.canonicalizer = Canonicalizer(config.canonical_rules, config.strip_params)
+        self.pages = PageStore(config.page_store, False)
+        self.simhash = simhash_factory(config, True) if config.simhash_file is not None else None
+        self.stats = CrawlStats(
+            f"{pickle_file_prefix}.pickle", True, config.stats_checkpoint_pages, config.stats_checkpoint_interval)
+        self.report_file = "report.txt"
+        self.traps = TrapDetector(
+            None, config.trap_max_depth, config.trap_max_repeats, config.trap_query_variants,
+            config.trap_date_urls, config.trap_duplicate_rate, config.trap_duplicate_samples)
+        self.metrics = Metrics(config.metrics_file, config.metrics_interval)
+        # started by a fork server, like the parsers of the crawler
+        self.parsers = ProcessPoolExecutor(
+            config.parsers_count, mp_context=multiprocessing.get_context("forkserver")
+        ) if config.parsers_count > 0 else None
+        # the workers are never started, they carry what scraper.scraper needs.
+        self.workers = [
+            worker_factory(
+                worker_id, config, None, self.simhash, self.stats, None, self.parsers, self.traps, self.metrics)
+            for worker_id in range(max(1, config.threads_count))]
+        self.stored = iter(self.pages)
+        self.lock = Lock()
+        self.links = 0
+
+    def _scrape(self, worker):
+        while True:
+            with self.lock:
+                url, resp = next(self.stored, (None, None))
+            if url is None:
+                break
+            # a redirect that was not followed has no page
+            if resp.location is not None:
+                continue
+            start = time.perf_counter()
+            try:
+                links = scraper.scraper(worker, url, resp)
+            except Exception as err:
+                self.metrics.count("scrape errors")
+                self.logger.error(f"Failed to scrape {url}: {err}")
+                continue
+            self.metrics.observe("scrape", start)
+            with self.lock:
+                self.links += len(links)
+
+    def start(self):
+        self.logger.info(f"Reprocessing {len(self.pages)} stored pages.")
+        start = time.perf_counter()
+        threads = [Thread(target=self._scrape, args=(worker,), daemon=True) for worker in self.workers]
+        self.metrics.start()
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            self.close()
+        elapsed = time.perf_counter() - start
+        self.logger.info(
+            f"Reprocessed {len(self.pages)} stored pages in {elapsed:.1f}s "
+            f"({len(self.pages) / elapsed:.1f} pages/sec): {len(self.stats)} pages counted, {self.links} links.")
+
+    def close(self):
+        if self.parsers is not None:
+            self.parsers.shutdown()
+        self.stats.close()
+        self.stats.write_report(self.report_file)
+        if self.simhash is not None:
+            self.simhash.save.close()
+        self.traps.close()
+        self.metrics.close()
+        self.pages.close()
@@ -0,0 +1,29 @@
+from threading import RLock
+
+
+class SeenIndex(object):
+    """
+    In-memory set of the urls the frontier has already seen.
+
+    The urls are kept as an exact set of 8 byte hash prefixes (stored as ints instead of 64 char
+    hex strings), which answers every check with one lookup. Two distinct urls collide on a 64 bit
+    prefix with negligible probability at crawl sizes (~5e-8 at a million urls).
+    """
+    def __init__(self):
+        self.lock = RLock()
+        self.prefixes = set()
+
+    @staticmethod
+    def _prefix(urlhash):
+        return int(urlhash[:16], 16)
+
+    def add(self, urlhash):
+        with self.lock:
+            self.prefixes.add(self._prefix(urlhash))
+
+    def __contains__(self, urlhash):
+        with self.lock:
+            return self._prefix(urlhash) in self.prefixes
+
+    def __len__(self):
+        return len(self.prefixes)
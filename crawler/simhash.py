@@ -6,11 +6,17 @@ from queue import Queue, Empty
 from hashlib import blake2b
 import numpy as np
 
-from utils import get_logger, get_urlhash, normalize
+from utils import get_logger, normalize
+from utils.simhash import compute_simhash
 from scraper import is_valid
 
 
 class SimHash:
+    # number of BYTES in a fingerprint
+    digest_size = 32
+    # number of bands the LSH index splits a fingerprint into
+    num_bands = 16
+
     def __init__(self, config, restart):
         self.logger = get_logger("SIMHASH")
         self.config = config
@@ -27,63 +33,128 @@ class SimHash:
             os.remove(self.config.simhash_file)
         # Load existing simhash file, or create one if it does not exist.
         self.save = shelve.open(self.config.simhash_file)
+        # shelve is not thread safe, every access goes through this lock.
+        self.lock = RLock()
+        self._build_index()
+
+    def _build_index(self):
+        """
+        In-memory LSH index over the stored fingerprints. The fingerprint is split into `num_bands` bands,
+        and each band value maps to the ids of the fingerprints sharing it. Two fingerprints that differ in
+        fewer than `num_bands` bits agree on at least one band, so their candidates contain each other.
+        The index is rebuilt from the fingerprints in the simhash file when it is opened. Fingerprints
+        of older simhash files, arrays of digest_size * 8 bit sums, are packed and written back.
+        """
+        self.band_size = self.digest_size // self.num_bands
+        self.buckets = [dict() for _ in range(self.num_bands)]
+        self.urls = []
+        self.fingerprints = np.zeros((1024, self.digest_size), dtype=np.uint8)
+        converted = dict()
+        for url, fingerprint in self.save.items():
+            if not isinstance(fingerprint, bytes):
+                fingerprint = converted[url] = np.packbits(np.asarray(fingerprint) > 0).tobytes()
+            self._index(url, fingerprint)
+        if converted:
+            # written back after the iteration, the simhash file is not changed while it is read
+            for url, fingerprint in converted.items():
+                self.save[url] = fingerprint
+            self.save.sync()
+            self.logger.info(f"Converted {len(converted)} simhash fingerprints to packed bytes.")
+        self.logger.info(f"Indexed {len(self.urls)} simhash fingerprints.")
+
+    def _index(self, url, fingerprint):
+        fp_id = len(self.urls)
+        if fp_id == len(self.fingerprints):
+            self.fingerprints = np.concatenate([self.fingerprints, np.zeros_like(self.fingerprints)])
+        self.fingerprints[fp_id] = np.frombuffer(fingerprint, dtype=np.uint8)
+        self.urls.append(url)
+        for band, bucket in enumerate(self.buckets):
+            key = fingerprint[band * self.band_size:(band + 1) * self.band_size]
+            bucket.setdefault(key, []).append(fp_id)
+
+    def _nearest(self, fingerprint, exhaustive=False):
+        """
+        Parameters
+        ----------
+        fingerprint: bytes
+        exhaustive: bool
+            compare against every indexed fingerprint instead of only those sharing a band with fingerprint.
+
+        Returns
+        -------
+        (str, float)
+            url and similarity of the most similar candidate, or (None, 0) when there is no candidate.
+        """
+        if exhaustive:
+            ids = np.arange(len(self.urls))
+        else:
+            candidates = set()
+            for band, bucket in enumerate(self.buckets):
+                candidates.update(bucket.get(fingerprint[band * self.band_size:(band + 1) * self.band_size], ()))
+            ids = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        if not len(ids):
+            return None, 0
+        xor = self.fingerprints[ids] ^ np.frombuffer(fingerprint, dtype=np.uint8)
+        distances = np.unpackbits(xor, axis=1).sum(axis=1)
+        best = int(distances.argmin())
+        return self.urls[ids[best]], 1 - int(distances[best]) / (self.digest_size * 8)
+
+    def _exhaustive(self, threshold):
+        """ The band index only guarantees to find fingerprints less than num_bands bits apart. """
+        return self.digest_size * 8 * (1 - threshold) >= self.num_bands
+
+    def _insert(self, url, fingerprint):
+        """ Store fingerprint under url in the simhash file and the index, without syncing the file. """
+        self.save[url] = fingerprint
+        self._index(url, fingerprint)
 
     def store_simhash(self, url, word_freq):
         url = normalize(url)
-        urlhash = get_urlhash(url)
-        if urlhash not in self.save:
-            self.save[url] = self._compute_simhash(word_freq)
-            self.save.sync()
+        with self.lock:
+            if url not in self.save:
+                self._insert(url, self._compute_simhash(word_freq))
+                self.save.sync()
+
+    def check_and_insert(self, url, word_freq, threshold=0.9, fingerprint=None):
+        """
+        Compare the page against the stored fingerprints and store its fingerprint unless it is a near duplicate.
+        Both happen under the lock, so two workers cannot both admit the same near duplicate page.
+        fingerprint is the page's _compute_simhash(word_freq) when it was already computed, e.g. by a parser process.
+
+        Returns
+        -------
+        (bool, str, float)
+            whether the page is a near duplicate, and the url and similarity of the most similar stored page.
+        """
+        url = normalize(url)
+        V = fingerprint if fingerprint is not None else self._compute_simhash(word_freq)
+        with self.lock:
+            max_url, max_sim = self._nearest(V, exhaustive=self._exhaustive(threshold))
+            is_duplicate = max_sim >= threshold
+            if not is_duplicate and url not in self.save:
+                self._insert(url, V)
+                self.save.sync()
+        return is_duplicate, max_url, max_sim
 
     def max_similarity(self, word_freq):
+        """ Only fingerprints that share a band with the page are considered, see _build_index. """
         V = self._compute_simhash(word_freq)
-        max_url, max_sim = None, 0
-        for url, vector in self.save.items():
-            sim = (vector == V).mean()
-            if sim > max_sim:
-                max_sim = sim
-                max_url = url
-        return max_url, max_sim
+        with self.lock:
+            return self._nearest(V)
     
     def is_near_duplicate(self, word_freq, threshold=0.9):
         V = self._compute_simhash(word_freq)
-        for vector in self.save.values():
-            if (vector == V).mean() >= threshold:
-                return True
-        return False
+        with self.lock:
+            return self._nearest(V, exhaustive=self._exhaustive(threshold))[1] >= threshold
 
     @staticmethod
-    def _compute_simhash(word_freq, digest_size=32):
-        """
-        Parameters
-        ----------
-        word_freq: dict
-            keys are tokens, values are the number of occurance of the token in a document.
-        digest_size: int
-            number of BYTES the hash function encodes the data into
+    def _similarity(fingerprint1, fingerprint2):
+        """ Fraction of equal bits between two packed fingerprints. """
+        xor = int.from_bytes(fingerprint1, "big") ^ int.from_bytes(fingerprint2, "big")
+        return 1 - bin(xor).count("1") / (len(fingerprint1) * 8)
 
-        Returns
-        -------
-        np.ndarray
-            1D binary array
-        """
-        simhash = np.zeros(digest_size * 8)
-        for token, freq in word_freq.items():
-            hash_bytes = blake2b(token.encode("utf-8"), digest_size=digest_size).digest()
-            vector = []
-            for byte_int in hash_bytes:
-                for bit in bin(byte_int)[2:]:
-                    bit = int(bit)
-                    vector.append(1 if bit > 0 else -1)  # simhash treats 0 terms as negative sign for multiplication
-
-            if len(vector) < digest_size * 8:
-                vector.extend([-1 for _ in range(digest_size * 8 - len(vector))])
-            # TODO: remove assert statement
-            assert len(vector) == digest_size * 8, f"{digest_size * 8} != len(vector) {len(vector)}"
-            simhash += freq * np.array(vector)
-        
-        simhash = (simhash > 0).astype(int)
-        return simhash
+    # kept in utils.simhash, which parser processes import without the crawler
+    _compute_simhash = staticmethod(compute_simhash)
 
 
 if __name__ == "__main__":
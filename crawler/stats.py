@@ -0,0 +1,162 @@
+import os
+import time
+import heapq
+import pickle
+
+from array import array
+from collections import Counter
+from queue import Queue
+from threading import Thread, RLock
+from urllib.parse import urlparse
+
+from utils import get_logger, get_urlhash
+from crawler.topk import TopKWords
+
+
+class CrawlStats(object):
+    """
+    Crawl statistics shared by all workers.
+
+    Workers hand pages to update(), which only enqueues them; one aggregator thread applies them, so
+    workers never wait on each other. The stats are checkpointed to `stats_file` every `checkpoint_pages`
+    pages or `checkpoint_interval` seconds, and on close().
+
+    The stats file is a pickled dict that holds the crawled urls as 8 byte url hash prefixes and the
+    unique page count per subdomain instead of the url strings, so reports never load every crawled url.
+    """
+    domains = [".ics.uci.edu"]
+    # default English stopwords list from https://www.ranks.nl/stopwords
+    stopwords = {'a', 'about', 'above', 'after', 'again', 'against', 'all', 'am', 'an', 'and', 'any', 'are', "aren't", 'as', 'at', 'be', 'because', 'been', 'before', 'being', 'below', 'between', 'both', 'but', 'by', "can't", 'cannot', 'could', "couldn't", 'did', "didn't", 'do', 'does', "doesn't", 'doing', "don't", 'down', 'during', 'each', 'few', 'for', 'from', 'further', 'had', "hadn't", 'has', "hasn't", 'have', "haven't", 'having', 'he', "he'd", "he'll", "he's", 'her', 'here', "here's", 'hers', 'herself', 'him', 'himself', 'his', 'how', "how's", 'i', "i'd", "i'll", "i'm", "i've", 'if', 'in', 'into', 'is', "isn't", 'it', "it's", 'its', 'itself', "let's", 'me', 'more', 'most', "mustn't", 'my', 'myself', 'no', 'nor', 'not', 'of', 'off', 'on', 'once', 'only', 'or', 'other', 'ought', 'our', 'ours', 'ourselves', 'out', 'over', 'own', 'same', "shan't", 'she', "she'd", "she'll", "she's", 'should', "shouldn't", 'so', 'some', 'such', 'than', 'that', "that's", 'the', 'their', 'theirs', 'them', 'themselves', 'then', 'there', "there's", 'these', 'they', "they'd", "they'll", "they're", "they've", 'this', 'those', 'through', 'to', 'too', 'under', 'until', 'up', 'very', 'was', "wasn't", 'we', "we'd", "we'll", "we're", "we've", 'were', "weren't", 'what', "what's", 'when', "when's", 'where', "where's", 'which', 'while', 'who', "who's", 'whom', 'why', "why's", 'with', "won't", 'would', "wouldn't", 'you', "you'd", "you'll", "you're", "you've", 'your', 'yours', 'yourself', 'yourselves'}
+
+    def __init__(self, stats_file, restart, checkpoint_pages=100, checkpoint_interval=60.0):
+        self.logger = get_logger("STATS")
+        self.stats_file = stats_file
+        self.checkpoint_pages = checkpoint_pages
+        self.checkpoint_interval = checkpoint_interval
+        self.lock = RLock()
+        # 8 byte url hash prefixes of the crawled pages
+        self.crawled_hashes = set()
+        self.max_url, self.max_word_num = None, 0
+        # word counts with the top 50 non-stopwords kept up to date
+        self.word_freq = TopKWords(50, self.stopwords)
+        # hostname -> number of unique pages crawled in it, for hostnames in `domains`
+        self.subdomain_pages = Counter()
+        if not restart and os.path.exists(self.stats_file):
+            self._load()
+        self.pages_since_checkpoint = 0
+        self.last_checkpoint = time.monotonic()
+
+        self.queue = Queue()
+        self.aggregator = Thread(target=self._aggregate, daemon=True)
+        self.aggregator.start()
+
+    def _load(self):
+        with open(self.stats_file, 'rb') as file:
+            saved = pickle.load(file)
+        self.crawled_hashes = set(array('Q', saved["crawled_hashes"]))
+        self.max_url, self.max_word_num = saved["max_page"]
+        self.word_freq = TopKWords(50, self.stopwords, saved["word_freq"])
+        self.subdomain_pages = Counter(saved["subdomain_pages"])
+
+    def __len__(self):
+        """ Number of unique pages crawled. """
+        return len(self.crawled_hashes)
+
+    def update(self, url, word_freq, token_num):
+        """ Queue one crawled page for the aggregator thread. """
+        self.queue.put((url, word_freq, token_num))
+
+    def _aggregate(self):
+        while True:
+            page = self.queue.get()
+            try:
+                if page is None:
+                    return
+                self._add_page(*page)
+            except Exception as err:
+                self.logger.error(f"Failed to add {page[0]} to the stats: {err}")
+            finally:
+                self.queue.task_done()
+
+    def _add_page(self, url, word_freq, token_num):
+        """ Costs O(number of distinct tokens in the page) outside checkpoints. """
+        with self.lock:
+            urlhash = int(get_urlhash(url)[:16], 16)
+            if urlhash in self.crawled_hashes:
+                self.logger.warning(f"{url} is already crawled")
+                return
+            self.crawled_hashes.add(urlhash)
+
+            if token_num > self.max_word_num:
+                self.max_url = url
+                self.max_word_num = token_num
+
+            self.word_freq.update(word_freq)
+
+            hostname = urlparse(url).hostname
+            if any(d in hostname for d in self.domains):
+                self.subdomain_pages[hostname] += 1
+
+            self.pages_since_checkpoint += 1
+            if (self.pages_since_checkpoint >= self.checkpoint_pages
+                    or time.monotonic() - self.last_checkpoint >= self.checkpoint_interval):
+                self.checkpoint()
+
+    def flush(self):
+        """ Wait until every queued page is added. """
+        self.queue.join()
+
+    def checkpoint(self):
+        """ Write the stats to the stats file. The previous file stays intact until the new one is complete. """
+        with self.lock:
+            tmp_file = f"{self.stats_file}.tmp"
+            with open(tmp_file, 'wb') as file:
+                pickle.dump({
+                    "crawled_hashes": array('Q', self.crawled_hashes).tobytes(),
+                    "max_page": (self.max_url, self.max_word_num),
+                    "word_freq": self.word_freq.counts,
+                    "subdomain_pages": dict(self.subdomain_pages)}, file)
+            os.replace(tmp_file, self.stats_file)
+            self.pages_since_checkpoint = 0
+            self.last_checkpoint = time.monotonic()
+
+    def close(self):
+        """ Add the queued pages, stop the aggregator thread and checkpoint. """
+        if self.aggregator.is_alive():
+            self.queue.put(None)
+            self.aggregator.join()
+        self.checkpoint()
+
+    def top_words(self, k=50):
+        """ The k most frequent words that are not stopwords, with their frequencies. """
+        with self.lock:
+            if k <= self.word_freq.k:
+                return self.word_freq.top()[:k]
+            words = ((word, freq) for word, freq in self.word_freq.counts.items() if word not in self.stopwords)
+            return heapq.nlargest(k, words, key=lambda item: item[1])
+
+    def report(self):
+        with self.lock:
+            msg = ""
+
+            # unique pages
+            msg += f"visited {len(self.crawled_hashes)} unique pages.\n\n"
+
+            # top 50 words
+            for word, freq in self.top_words(50):
+                msg += f"{word} -> {freq}\n"
+            msg += "\n"
+
+            # url with the most words
+            msg += f"{self.max_url} has the most words.\nIt has {self.max_word_num} words in the page.\n\n"
+
+            # list of alphabetically ordered subdomains of ics.uci.edu with their number of unique pages
+            msg += f"{len(self.subdomain_pages)} ics subdomains:\n"
+            for domain in sorted(self.subdomain_pages):
+                msg += f"{domain}, {self.subdomain_pages[domain]}\n"
+            msg += "\n"
+        return msg
+
+    def write_report(self, report_file):
+        with open(report_file, 'w') as file:
+            file.write(self.report())
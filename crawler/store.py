@@ -0,0 +1,161 @@
+import os
+import time
+import sqlite3
+
+from threading import RLock
+
+
+class FrontierStore(object):
+    """
+    SQLite (WAL mode) persistence for the frontier, used in place of a shelve.
+
+    Writes are buffered in memory and committed in one transaction once `batch_size` records are
+    buffered or `flush_interval` seconds passed since the last commit, instead of one dbm sync per url.
+    A crash loses at most the last unflushed batch: those urls are rediscovered or downloaded again on resume.
+
+    Supports the subset of the shelve interface the frontier uses: `store[urlhash] = (url, completed)`,
+    `store[urlhash]`, `urlhash in store`, `len(store)`, `store.items()`, `store.values()`,
+    `store.sync()` and `store.close()`, and the bulk `store.update(records)` and `store.existing(urlhashes)`
+    for the outlinks of a page. A partial index over the pending urls lets `pending()` read them
+    without scanning the completed ones, and `pending()` and `hashes()` read in batches, so the
+    frontier can load a large save file in the background while it keeps writing to it.
+    """
+    def __init__(self, path, flush_interval=1.0, batch_size=10000):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.lock = RLock()
+        # urlhash -> (url, completed) not committed yet.
+        self.buffer = dict()
+        self.last_flush = time.monotonic()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS urls ("
+            "urlhash TEXT PRIMARY KEY, url TEXT NOT NULL, completed INTEGER NOT NULL) WITHOUT ROWID")
+        # only holds the pending urls, building it on a save file of an older version scans the table once.
+        self.conn.execute("CREATE INDEX IF NOT EXISTS pending ON urls (urlhash) WHERE completed = 0")
+        self.conn.commit()
+
+    @staticmethod
+    def remove(path):
+        """ Delete the database file at path together with its WAL and shared memory files. """
+        for file in (path, f"{path}-wal", f"{path}-shm"):
+            if os.path.exists(file):
+                os.remove(file)
+
+    def __setitem__(self, urlhash, record):
+        url, completed = record
+        with self.lock:
+            self.buffer[urlhash] = (url, completed)
+            if (len(self.buffer) >= self.batch_size
+                    or time.monotonic() - self.last_flush >= self.flush_interval):
+                self.flush()
+
+    def update(self, records):
+        """ Buffer a dict of urlhash -> (url, completed), flushing at most once. """
+        with self.lock:
+            self.buffer.update(records)
+            if (len(self.buffer) >= self.batch_size
+                    or time.monotonic() - self.last_flush >= self.flush_interval):
+                self.flush()
+
+    def existing(self, urlhashes):
+        """ The set of urlhashes that have a record, looked up with one query per 500 hashes. """
+        with self.lock:
+            found = {urlhash for urlhash in urlhashes if urlhash in self.buffer}
+            missing = [urlhash for urlhash in urlhashes if urlhash not in found]
+            # stays below the 999 variables older SQLite versions allow in a statement
+            for i in range(0, len(missing), 500):
+                chunk = missing[i:i + 500]
+                found.update(urlhash for urlhash, in self.conn.execute(
+                    f"SELECT urlhash FROM urls WHERE urlhash IN ({','.join('?' * len(chunk))})", chunk))
+        return found
+
+    def __getitem__(self, urlhash):
+        with self.lock:
+            if urlhash in self.buffer:
+                return self.buffer[urlhash]
+            row = self.conn.execute(
+                "SELECT url, completed FROM urls WHERE urlhash = ?", (urlhash,)).fetchone()
+        if row is None:
+            raise KeyError(urlhash)
+        return row[0], bool(row[1])
+
+    def __contains__(self, urlhash):
+        with self.lock:
+            if urlhash in self.buffer:
+                return True
+            return self.conn.execute(
+                "SELECT 1 FROM urls WHERE urlhash = ?", (urlhash,)).fetchone() is not None
+
+    def __len__(self):
+        with self.lock:
+            self.flush()
+            return self.conn.execute("SELECT COUNT(*) FROM urls").fetchone()[0]
+
+    def __bool__(self):
+        with self.lock:
+            return bool(self.buffer) or self.conn.execute("SELECT 1 FROM urls LIMIT 1").fetchone() is not None
+
+    def items(self):
+        """ Iterate over (urlhash, (url, completed)) of every record. """
+        with self.lock:
+            self.flush()
+            rows = self.conn.execute("SELECT urlhash, url, completed FROM urls").fetchall()
+        for urlhash, url, completed in rows:
+            yield urlhash, (url, bool(completed))
+
+    def _batches(self, query, batch_size):
+        """ Run query with the last urlhash read so far until it returns no rows, holding the lock per batch only. """
+        last = ""
+        while True:
+            with self.lock:
+                self.flush()
+                rows = self.conn.execute(query, (last, batch_size)).fetchall()
+            if not rows:
+                return
+            yield rows
+            last = rows[-1][0]
+
+    def pending(self, batch_size=10000):
+        """ Iterate over lists of (urlhash, url) of the records that are not completed, in urlhash order. """
+        return self._batches(
+            "SELECT urlhash, url FROM urls WHERE completed = 0 AND urlhash > ? ORDER BY urlhash LIMIT ?", batch_size)
+
+    def hashes(self, batch_size=100000):
+        """ Iterate over lists of 1-tuples (urlhash,) of every record, in urlhash order. """
+        return self._batches("SELECT urlhash FROM urls WHERE urlhash > ? ORDER BY urlhash LIMIT ?", batch_size)
+
+    def values(self):
+        """ Iterate over (url, completed) of every record. """
+        for _, record in self.items():
+            yield record
+
+    def flush(self):
+        """ Commit the buffered records in a single transaction. """
+        with self.lock:
+            if self.buffer:
+                with self.conn:
+                    self.conn.executemany(
+                        "INSERT INTO urls (urlhash, url, completed) VALUES (?, ?, ?) "
+                        "ON CONFLICT(urlhash) DO UPDATE SET url = excluded.url, completed = excluded.completed",
+                        ((urlhash, url, int(completed)) for urlhash, (url, completed) in self.buffer.items()))
+                self.buffer.clear()
+            self.last_flush = time.monotonic()
+
+    def sync(self):
+        """ Only flushes when the flush interval elapsed, so callers may keep calling it after every write. """
+        with self.lock:
+            if time.monotonic() - self.last_flush >= self.flush_interval:
+                self.flush()
+
+    def close(self):
+        with self.lock:
+            if self.conn is None:
+                # closing an already closed store raises ValueError, like shelve does
+                raise ValueError("FrontierStore is already closed")
+            self.flush()
+            self.conn.close()
+            self.conn = None
@@ -0,0 +1,58 @@
+import heapq
+
+
+class TopKWords(object):
+    """
+    Exact word counts with the k most frequent words (ignoring `excluded` words) maintained incrementally.
+
+    Counts only grow, so a word outside the top k can only enter it by passing the smallest count in it.
+    The top k live in a min-heap whose entries may lag behind the counts; stale entries are refreshed when
+    they reach the root, so each update costs O(log k) and top() costs O(k log k) at any time, without
+    sorting the whole vocabulary.
+
+    Counts are kept in a plain dict of word -> count: in CPython it is smaller than interned ids with an
+    array of counts, since most words occur only a few times and small ints are shared objects.
+    """
+    def __init__(self, k=50, excluded=(), counts=None):
+        self.k = k
+        self.excluded = excluded
+        self.counts = dict()
+        # min-heap of (count, word) of the current top k. count may be lower than self.counts[word].
+        self.heap = []
+        self.members = set()
+        if counts:
+            self.counts = dict(counts)
+            self.heap = heapq.nlargest(
+                k, ((count, word) for word, count in self.counts.items() if word not in excluded))
+            heapq.heapify(self.heap)
+            self.members = {word for _, word in self.heap}
+
+    def __len__(self):
+        """ Number of distinct words. """
+        return len(self.counts)
+
+    def update(self, word_freq):
+        counts = self.counts
+        for word, freq in word_freq.items():
+            counts[word] = counts.get(word, 0) + freq
+            if word not in self.members and word not in self.excluded:
+                self._offer(word)
+
+    def _offer(self, word):
+        count = self.counts[word]
+        heap = self.heap
+        if len(heap) < self.k:
+            heapq.heappush(heap, (count, word))
+            self.members.add(word)
+            return
+        # bring the root up to date, so it holds the true smallest count of the top k.
+        while heap[0][0] != self.counts[heap[0][1]]:
+            heapq.heapreplace(heap, (self.counts[heap[0][1]], heap[0][1]))
+        if count > heap[0][0]:
+            _, evicted = heapq.heapreplace(heap, (count, word))
+            self.members.discard(evicted)
+            self.members.add(word)
+
+    def top(self):
+        """ The top k words with their counts, most frequent first. """
+        return sorted(((word, self.counts[word]) for word in self.members), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,164 @@
+import os
+import re
+import json
+
+from collections import Counter, namedtuple
+from threading import RLock
+from urllib.parse import urlparse
+
+from utils import get_logger
+
+
+# A decision of the trap detector about the urls matching a pattern.
+# kind "query": urls of `host` with path `path` and a query string.
+# kind "date": urls of `host` under the first path segment `path` with a calendar date in them.
+# kind "duplicate": urls of `host` under the first path segment `path`.
+# action "throttle" admits one in TrapDetector.throttle_ratio new urls, "block" admits none.
+TrapDecision = namedtuple("TrapDecision", ["kind", "host", "path", "action", "reason"])
+
+DATE_PATTERN = re.compile(
+    r"(?:19|20)\d\d[/-](?:0?[1-9]|1[0-2])(?:[/-](?:0?[1-9]|[12]\d|3[01]))?(?:/|$|&|T)"
+    r"|(?:date|day|month|year|ical|calendar)=", re.IGNORECASE)
+
+
+class TrapDetector(object):
+    """
+    Detects crawler traps from the urls the frontier discovers and the pages the workers scrape.
+
+    Single urls are rejected when their path is deeper than `max_depth` segments, or repeats a segment
+    `max_repeats` times (e.g. /a/b/a/b/a/b from relative links). Patterns of urls are counted:
+    - new urls with a query string per host and path, a calendar or query explosion past `query_variants`,
+    - new urls with a date in them per host and first path segment, past `date_urls`,
+    - near duplicate pages per host and first path segment, once `duplicate_rate` of at least
+      `duplicate_samples` scraped pages were near duplicates.
+    A pattern is throttled at half its threshold and blocked at the threshold. Decisions are logged and
+    written to the json `trap_file`, which is read back on start, also with --restart.
+    """
+    throttle_ratio = 4
+
+    def __init__(self, trap_file=None, max_depth=12, max_repeats=3, query_variants=200, date_urls=100,
+                 duplicate_rate=0.5, duplicate_samples=20):
+        self.logger = get_logger("TRAPS")
+        self.trap_file = trap_file
+        self.max_depth = max_depth
+        self.max_repeats = max_repeats
+        self.query_variants = query_variants
+        self.date_urls = date_urls
+        self.duplicate_rate = duplicate_rate
+        self.duplicate_samples = duplicate_samples
+        self.lock = RLock()
+        # (kind, host, path) -> TrapDecision
+        self.decisions = dict()
+        # (kind, host, path) -> number of new urls, or scraped pages for "duplicate"
+        self.counts = Counter()
+        self.duplicates = Counter()
+        # (kind, host, path) -> number of urls seen since the pattern was throttled
+        self.throttled = Counter()
+        # reason -> number of urls rejected for it
+        self.rejected = Counter()
+        if trap_file is not None and os.path.exists(trap_file):
+            self._load()
+
+    def _load(self):
+        with open(self.trap_file, encoding="utf-8") as file:
+            for decision in json.load(file)["decisions"]:
+                decision = TrapDecision(**decision)
+                self.decisions[decision[:3]] = decision
+        self.logger.info(f"Loaded {len(self.decisions)} trap decisions from {self.trap_file}.")
+
+    def _save(self):
+        if self.trap_file is None:
+            return
+        tmp_file = f"{self.trap_file}.tmp"
+        with open(tmp_file, 'w', encoding="utf-8") as file:
+            json.dump({"decisions": [decision._asdict() for decision in self.decisions.values()]}, file, indent=2)
+        os.replace(tmp_file, self.trap_file)
+
+    @staticmethod
+    def _patterns(parsed):
+        """ The (kind, host, path) patterns a parsed url belongs to. """
+        host = parsed.hostname or ""
+        segment = parsed.path.strip("/").split("/", 1)[0]
+        patterns = [("duplicate", host, segment)]
+        if parsed.query:
+            patterns.append(("query", host, parsed.path))
+        if DATE_PATTERN.search(parsed.path) or DATE_PATTERN.search(parsed.query):
+            patterns.append(("date", host, segment))
+        return patterns
+
+    def _decide(self, pattern, score, reason):
+        """ Throttle or block pattern for a score relative to its threshold. Caller holds the lock. """
+        action = "block" if score >= 1 else "throttle" if score >= 0.5 else None
+        current = self.decisions.get(pattern)
+        if action is None or (current is not None and (current.action == "block" or action == "throttle")):
+            return
+        decision = TrapDecision(*pattern, action, reason)
+        self.decisions[pattern] = decision
+        self.logger.info(f"{action} {pattern[0]} pattern {pattern[1]}/{pattern[2]}: {reason}")
+        self._save()
+
+    def _admitted(self, pattern):
+        """ Whether a new url of pattern gets past the decision about it. Caller holds the lock. """
+        decision = self.decisions.get(pattern)
+        if decision is None:
+            return True
+        if decision.action == "block":
+            return False
+        self.throttled[pattern] += 1
+        return self.throttled[pattern] % self.throttle_ratio == 1
+
+    def admit(self, url):
+        """ Count a newly discovered url, and return whether the frontier should queue it. """
+        parsed = urlparse(url)
+        segments = [segment for segment in parsed.path.split("/") if segment]
+        with self.lock:
+            if len(segments) > self.max_depth:
+                self.rejected["depth"] += 1
+                return False
+            if segments and Counter(segments).most_common(1)[0][1] >= self.max_repeats:
+                self.rejected["repeated segments"] += 1
+                return False
+            patterns = self._patterns(parsed)
+            for pattern in patterns:
+                if not self._admitted(pattern):
+                    self.rejected[pattern[0]] += 1
+                    return False
+            for pattern in patterns:
+                kind = pattern[0]
+                if kind == "query":
+                    self.counts[pattern] += 1
+                    self._decide(pattern, self.counts[pattern] / self.query_variants,
+                                 f"{self.counts[pattern]} query variants")
+                elif kind == "date":
+                    self.counts[pattern] += 1
+                    self._decide(pattern, self.counts[pattern] / self.date_urls,
+                                 f"{self.counts[pattern]} urls with dates")
+            return True
+
+    def is_blocked(self, url):
+        """ Whether a queued url matches a blocked pattern, so it should not be downloaded. """
+        parsed = urlparse(url)
+        with self.lock:
+            for pattern in self._patterns(parsed):
+                decision = self.decisions.get(pattern)
+                if decision is not None and decision.action == "block":
+                    return True
+            return False
+
+    def record_page(self, url, is_duplicate):
+        """ Count a scraped page and whether simhash found it to be a near duplicate. """
+        pattern = self._patterns(urlparse(url))[0]
+        with self.lock:
+            self.counts[pattern] += 1
+            self.duplicates[pattern] += bool(is_duplicate)
+            pages = self.counts[pattern]
+            if pages >= self.duplicate_samples:
+                rate = self.duplicates[pattern] / pages
+                self._decide(pattern, rate / self.duplicate_rate,
+                             f"{self.duplicates[pattern]} of {pages} pages are near duplicates")
+
+    def close(self):
+        with self.lock:
+            self._save()
+            if self.rejected:
+                self.logger.info("Rejected urls: " + ", ".join(f"{reason} {count}" for reason, count in self.rejected.items()))
@@ -1,161 +1,132 @@
 from threading import Thread
-import copy
-import pickle
-from urllib.parse import urlparse
 
 from inspect import getsource
 from utils.download import download
 from utils import get_logger
+from crawler.metrics import Metrics
+from urllib.parse import urlparse
 import scraper
 import time
 
 
 class Worker(Thread):
-    # default English stopwords list from https://www.ranks.nl/stopwords
-    stopwords = {'a', 'about', 'above', 'after', 'again', 'against', 'all', 'am', 'an', 'and', 'any', 'are', "aren't", 'as', 'at', 'be', 'because', 'been', 'before', 'being', 'below', 'between', 'both', 'but', 'by', "can't", 'cannot', 'could', "couldn't", 'did', "didn't", 'do', 'does', "doesn't", 'doing', "don't", 'down', 'during', 'each', 'few', 'for', 'from', 'further', 'had', "hadn't", 'has', "hasn't", 'have', "haven't", 'having', 'he', "he'd", "he'll", "he's", 'her', 'here', "here's", 'hers', 'herself', 'him', 'himself', 'his', 'how', "how's", 'i', "i'd", "i'll", "i'm", "i've", 'if', 'in', 'into', 'is', "isn't", 'it', "it's", 'its', 'itself', "let's", 'me', 'more', 'most', "mustn't", 'my', 'myself', 'no', 'nor', 'not', 'of', 'off', 'on', 'once', 'only', 'or', 'other', 'ought', 'our', 'ours', 'ourselves', 'out', 'over', 'own', 'same', "shan't", 'she', "she'd", "she'll", "she's", 'should', "shouldn't", 'so', 'some', 'such', 'than', 'that', "that's", 'the', 'their', 'theirs', 'them', 'themselves', 'then', 'there', "there's", 'these', 'they', "they'd", "they'll", "they're", "they've", 'this', 'those', 'through', 'to', 'too', 'under', 'until', 'up', 'very', 'was', "wasn't", 'we', "we'd", "we'll", "we're", "we've", 'were', "weren't", 'what', "what's", 'when', "when's", 'where', "where's", 'which', 'while', 'who', "who's", 'whom', 'why', "why's", 'with', "won't", 'would', "wouldn't", 'you', "you'd", "you'll", "you're", "you've", 'your', 'yours', 'yourself', 'yourselves'}
-    def __init__(self, worker_id, config, frontier, simhash, restart):
+    def __init__(self, worker_id, config, frontier, simhash, stats, downloads=None, parsers=None, traps=None,
+                 metrics=None, pages=None):
         self.logger = get_logger(f"Worker-{worker_id}", "Worker")
         self.worker_id = worker_id
         self.config = config
         self.frontier = frontier
         self.simhash = simhash
-        self.restart = restart
-        self.pickle_file = f"stats_{self.worker_id}.pickle"
-        self.report_file = f"report_{self.worker_id}.txt"
-        self.pickle_init()
+        self.stats = stats
+        # queue of (url, resp) filled by the fetchers in pipeline mode. None if the worker downloads itself.
+        self.downloads = downloads
+        # concurrent.futures.ProcessPoolExecutor scraper.parse_page runs in. None to parse in the worker thread.
+        self.parsers = parsers
+        # crawler.traps.TrapDetector told about near duplicate pages. None if there is no detector.
+        self.traps = traps
+        # crawler.metrics.Metrics timing the stages of every page
+        self.metrics = metrics if metrics is not None else Metrics()
+        # crawler.page_store.PageStore every downloaded response is appended to. None to not store them.
+        self.pages = pages
+        # whether the page being scraped was counted in the stats, for the priority policy of the frontier
+        self.page_counted = False
         
         # basic check for requests in scraper
         assert {getsource(scraper).find(req) for req in {"from requests import", "import requests"}} == {-1}, "Do not use requests from scraper.py"
         super().__init__(daemon=True)
-    
-    def pickle_init(self):
-        if self.restart:
-            # wipes out all content if the file already exists.
-            mode = 'wb'
-        else:
-            # if don't restart, exclusive creation will raise FileExistsError.
-            # Ignore the FileExistsError since we want to continue to use the data in that file.
-            mode = "xb"
-        try:
-            with open(self.pickle_file, mode) as file:
-                crawled_urls, (max_url, max_word_num), word_freq, ics_subdomains = set(), (None, 0), dict(), set()
-                pickle.dump((crawled_urls, (max_url, max_word_num), word_freq, ics_subdomains), file)
-        except FileExistsError:
-            pass
 
     def update_stats(self, url, word_freq, token_num):
-        domains = [".ics.uci.edu"]
-        with open(self.pickle_file, 'rb') as file_r:
-            crawled_urls, (max_url, max_word_num), total_word_freq, ics_subdomains = pickle.load(file_r)
-            print(f"crawled {len(crawled_urls)} pages. Has {token_num} words. Max so far has {max_word_num}: {max_url}\n")
-            
-            assert url not in crawled_urls, f"{url} is already crawled"
-            crawled_urls.add(url)
-
-            if token_num > max_word_num:
-                max_url = url
-                max_word_num = token_num
-            
-            total_word_freq = self.add_word_freqs(total_word_freq, word_freq)
-
-            hostname = urlparse(url).hostname
-            if any(d in hostname for d in domains):
-                ics_subdomains.add(hostname)
-            
-
-        with open(self.pickle_file, 'wb') as file_w:
-            pickle.dump((crawled_urls, (max_url, max_word_num), total_word_freq, ics_subdomains), file_w)
-
-    def report_stats(self):
-        with open(self.pickle_file, 'rb') as file_r:
-            crawled_urls, (max_url, max_word_num), total_word_freq, ics_subdomains = pickle.load(file_r)
-        
-        msg = ""
-    
-        # unique pages
-        msg += f"visited {len(crawled_urls)} unique pages.\n\n"
-
-        # top 50 words
-        topk_words = []
-        k = 50
-        for word, freq in sorted(total_word_freq.items(), key=lambda item: item[1], reverse=True):
-            if word not in Worker.stopwords:
-                topk_words.append((word, freq))
-                if len(topk_words) >= k:
-                    break
-        for word, freq in topk_words:
-            msg += f"{word} -> {freq}\n"
-        msg += "\n"
-
-        # url with the most words
-        msg += f"{max_url} has the most words.\nIt has {max_word_num} words in the page.\n\n"
-
-        # list of alphabetically ordered subdomains of ics.uci.edu
-        msg += "ics subdomains:\n"
-        for domain in sorted(ics_subdomains):
-            msg += domain + "\n"
-        msg += "\n"
+        start = time.perf_counter()
+        print(f"crawled {len(self.stats)} pages. Has {token_num} words. Max so far has {self.stats.max_word_num}: {self.stats.max_url}\n")
+        self.stats.update(url, word_freq, token_num)
+        self.page_counted = True
+        self.metrics.observe("stats", start)
+        self.metrics.count("pages")
 
-        # write report to disk
-        with open(self.report_file, 'w') as file:
-            file.write(msg)
-
-    def clean_up(self):
+    def next_download(self):
+        """
+        Returns
+        -------
+        (str, utils.response.Response)
+            the next url to scrape and its response, or (None, None) when crawling is over.
+            resp is None when the fetcher failed to download the url.
+        """
+        if self.downloads is not None:
+            # the crawler puts one (None, None) per worker once every fetcher stopped.
+            return self.downloads.get()
+        start = time.perf_counter()
+        tbd_url = self.frontier.get_tbd_url()
+        self.metrics.observe("frontier get", start)
+        if not tbd_url:
+            return None, None
+        start = time.perf_counter()
         try:
-            self.frontier.save.close()
-        except ValueError:
-            # closing an already closed shelve file raises ValueError
-            # if the file has already been closed before, do nothing more
-            pass
-        
-        if self.simhash.save is not None:
-            try:
-                self.simhash.save.close()
-            except ValueError:
-                pass
-    
-    @staticmethod
-    def add_word_freqs(freq_count1: dict, freq_count2: dict):
-        freq_count1 = copy.copy(freq_count1)
-        freq_count2 = copy.copy(freq_count2)
-
-        # make sure freq_count1 is the larger dict
-        if len(freq_count1) < len(freq_count2):
-            temp = freq_count1
-            freq_count1 = freq_count2
-            freq_count2 = temp
+            resp = download(tbd_url, self.config, self.logger)
+        except Exception as err:
+            self.logger.error(f"Failed to download {tbd_url}: {err}")
+            self.metrics.count("download errors")
+            return tbd_url, None
+        self.metrics.observe("download", start)
+        self.metrics.fetched(urlparse(tbd_url).hostname, resp.status)
+        return tbd_url, resp
 
-        for token in freq_count2.keys():
-            freq_count1[token] = freq_count1.get(token, 0) + freq_count2[token]
-        return freq_count1
-        # return {token: freq_count1.get(token, 0) + freq_count2.get(token, 0) for token in all_tokens}
-        
     def run(self):
         while True:
+            tbd_url = None
+            self.page_counted = False
             try:
-                tbd_url = self.frontier.get_tbd_url()
+                tbd_url, resp = self.next_download()
                 if not tbd_url:
                     self.logger.info("Frontier is empty. Stopping Crawler.")
                     break
-                resp = download(tbd_url, self.config, self.logger)
+                if resp is None:
+                    continue
                 self.logger.info(
                     f"Downloaded {tbd_url}, status <{resp.status}>, "
                     f"using cache {self.config.cache_server}.")
+                if resp.location is not None:
+                    self.frontier.add_redirect(tbd_url, resp.location, fetched=False)
+                else:
+                    if resp.status == 200:
+                        # parsed first: a parser process reports the url the page was served from, so the
+                        # response is not unpickled here for it. A page redirected to a url downloaded already
+                        # is parsed for nothing, which is rare.
+                        scraper.parse(self, tbd_url, resp)
+                    if resp.final_url != tbd_url and not self.frontier.add_redirect(tbd_url, resp.final_url):
+                        self.logger.info(f"Redirected to {resp.final_url}, which was downloaded already.")
+                        self.metrics.count("redirects downloaded already")
+                        continue
+                # stored as it is scraped, so reprocessing the store scrapes the same pages
+                if self.pages is not None:
+                    start = time.perf_counter()
+                    self.pages.append(tbd_url, resp)
+                    self.metrics.observe("store", start)
+                start = time.perf_counter()
                 scraped_urls = scraper.scraper(self, tbd_url, resp)
-                for scraped_url in scraped_urls:
-                    self.frontier.add_url(scraped_url)
+                self.metrics.observe("scrape", start)
+                start = time.perf_counter()
+                self.metrics.count("new urls", self.frontier.add_urls(scraped_urls, source=tbd_url))
+                self.metrics.observe("frontier add", start)
             except KeyboardInterrupt:
                 raise
             except Exception as err:
+                self.metrics.count("scrape errors")
                 print("Error occured", time.time())
                 print(err)
                 print(tbd_url)
                 print()
             finally:
-                try:
-                    self.frontier.mark_url_complete(tbd_url)
-                    time.sleep(self.config.time_delay)
-                except:
-                    pass
-        
-        self.report_stats()
+                # the frontier enforces the politeness delay per host once the url is marked complete.
+                if tbd_url is not None:
+                    start = time.perf_counter()
+                    try:
+                        self.frontier.record_page(tbd_url, self.page_counted)
+                    except Exception as err:
+                        self.logger.error(f"Failed to record {tbd_url} for the priority policy: {err}")
+                    finally:
+                        # always, or the host stays busy and the other workers wait for it forever.
+                        try:
+                            self.frontier.mark_url_complete(tbd_url)
+                        except Exception as err:
+                            self.logger.error(f"Failed to mark {tbd_url} complete: {err}")
+                    self.metrics.observe("frontier complete", start)
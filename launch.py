@@ -4,12 +4,17 @@ from argparse import ArgumentParser
 from utils.server_registration import get_cache_server
 from utils.config import Config
 from crawler import Crawler
+from crawler.reprocess import Reprocessor
 
 
-def main(config_file, restart):
+def main(config_file, restart, reprocess):
     cparser = ConfigParser()
     cparser.read(config_file)
     config = Config(cparser)
+    if reprocess:
+        # scrape the stored pages again, the cache server is not needed.
+        Reprocessor(config).start()
+        return
     config.cache_server = get_cache_server(config, restart)
     crawler = Crawler(config, restart)
     crawler.start()
@@ -19,5 +24,6 @@ if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument("--restart", action="store_true", default=False)
     parser.add_argument("--config_file", type=str, default="config.ini")
+    parser.add_argument("--reprocess", action="store_true", default=False)
     args = parser.parse_args()
-    main(args.config_file, args.restart)
+    main(args.config_file, args.restart, args.reprocess)
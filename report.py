@@ -0,0 +1,19 @@
+from argparse import ArgumentParser
+
+from crawler.stats import CrawlStats
+
+
+def main(stats_file, report_file):
+    stats = CrawlStats(stats_file, restart=False)
+    if report_file is None:
+        print(stats.report())
+    else:
+        stats.write_report(report_file)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--stats_file", type=str, default="stats.pickle")
+    parser.add_argument("--report_file", type=str, default=None)
+    args = parser.parse_args()
+    main(args.stats_file, args.report_file)
@@ -1,10 +1,20 @@
 import re
+from collections import Counter
 from urllib.parse import urlparse, urljoin
-from bs4 import BeautifulSoup
 import lxml.html as lh
+from lxml import etree
 from hashlib import blake2b
 import pickle
-from crawler.worker import Worker
+import time
+from typing import TYPE_CHECKING
+from utils.url_filter import URLFilter
+from utils.canonicalize import Canonicalizer
+from utils.charset import resolve_charset, detect_charset
+from utils.simhash import compute_simhash
+
+if TYPE_CHECKING:
+    # only for annotations: importing crawler here would import scraper back through crawler.frontier.
+    from crawler.worker import Worker
 
 # How many unique pages did you find? Uniqueness for the purposes of this assignment is ONLY established by the URL,
 # but discarding the fragment part. So, for example, http://www.ics.uci.edu#aaa and http://www.ics.uci.edu#bbb are
@@ -23,17 +33,21 @@ from crawler.worker import Worker
 
 
 domains = {".ics.uci.edu", ".cs.uci.edu", ".informatics.uci.edu", ".stat.uci.edu"}
+# replaced by the crawler with a filter using the trap rules of its config
+url_filter = URLFilter(domains)
+# replaced by the crawler with the canonicalization rules of its config
+canonicalizer = Canonicalizer()
 
 # worker.word_freq = dict()
 # max_word_url = (None, 0)
 # crawled_urls = set()
 
 def scraper(worker, url, resp):
-    links = extract_next_links(worker, url, resp, min_token=130)
+    links = canonicalizer.collapse(extract_next_links(worker, url, resp, min_token=130))
     return [link for link in links if is_valid(link)]
 
 
-def extract_next_links(worker: Worker, url, resp, min_token):
+def extract_next_links(worker: "Worker", url, resp, min_token):
     """
 
     Parameters
@@ -59,124 +73,203 @@ def extract_next_links(worker: Worker, url, resp, min_token):
     urls = []
     try:
         if resp.status == 200:
-            if 'Content-Type' not in resp.raw_response.headers or any(format in resp.raw_response.headers['Content-Type'].lower() for format in ["text/html", "text/plain"]):
-                if 'Content-Type' in resp.raw_response.headers:
-                    charset = resp.raw_response.encoding  # response content encoding
-                else:
-                    charset = resp.raw_response.apparent_encoding
-                
-                if charset is None:
-                    charset = 'utf-8'
-
-                # in case the response header returns the wrong charset encoding
-                try:
-                    text = resp.raw_response.content.decode(charset)
-                except UnicodeDecodeError:
-                    if resp.raw_response.apparent_encoding is not None:
-                        text = resp.raw_response.content.decode(resp.raw_response.apparent_encoding)
-                    else:
-                        raise
-
-                # if content type is HTML
-                if 'Content-Type' not in resp.raw_response.headers or "text/html" in resp.raw_response.headers['Content-Type'].lower():
-                    soup = BeautifulSoup(text, "html.parser")
-                    # extract urls from the response page
-                    doc: lh.HtmlElement = lh.fromstring(resp.raw_response.content, resp.url)
-                    doc.make_links_absolute()
-                    
-                    for _, _, link, _ in doc.iterlinks():
-                        urls.append(urlparse(link)._replace(fragment="").geturl())
-
-                    # token statistics
-                    text = soup.get_text()
-
-                # if content type is plain text
-                elif "text/plain" in resp.raw_response.headers['Content-Type'].lower():
-                    text = resp.raw_response.content.decode(charset)
-                    urls.extend(txt_to_urls(text, fragments=False))
-                
-                # otherwise, don't crawl
-                else:
+            parsed = parse(worker, url, resp)
+
+            # content type we don't crawl
+            if not parsed:
+                return []
+            urls, word_freq, token_num, fingerprint, timings = parsed
+            for stage, seconds in timings.items():
+                worker.metrics.record(stage, seconds)
+
+            # don't crawl low info page
+            if token_num < min_token:
+                worker.metrics.count("low information pages")
+                return []
+            # don't crawl near duplicate page
+            elif worker.simhash is not None:
+                start = time.perf_counter()
+                is_duplicate, max_url, max_sim = worker.simhash.check_and_insert(
+                    resp.url, word_freq, threshold=0.995, fingerprint=fingerprint)
+                worker.metrics.observe("simhash", start)
+                print(max_sim, max_url)
+                if worker.traps is not None:
+                    worker.traps.record_page(resp.url, is_duplicate)
+                if is_duplicate:
+                    worker.metrics.count("near duplicates")
                     return []
 
-                # if any of the accepted format, compute token statistics
-                tokens = tokenize(text)
-                word_freq = compute_word_frequencies(tokens)
-                token_num = len(tokens)
-
-                if worker.simhash is not None:
-                    max_url, max_sim = worker.simhash.max_similarity(word_freq)
-                    print(max_sim, max_url)
-
-                # don't crawl low info page
-                if token_num < min_token:
-                    return []
-                # don't crawl near duplicate page
-                elif worker.simhash is not None:
-                    if worker.simhash.is_near_duplicate(word_freq, threshold=0.995):
-                        return []
-                    else:
-                        worker.simhash.store_simhash(resp.url, word_freq)
-                
-                worker.update_stats(resp.url, word_freq, token_num)
+            worker.update_stats(resp.url, word_freq, token_num)
 
         else:
             print(f"error {resp.status}: {resp.error}, {resp.url}")
     
-    except UnicodeDecodeError:
-        print("UnicodeDecodeError:")
-        print(f"error {resp.status}: {resp.error}, {resp.url}, {resp.raw_response.apparent_encoding}, {resp.raw_response.encoding}, {resp.raw_response.headers}")
     except:
         if resp.raw_response:
-            print(f"error {resp.status}: {resp.error}, {resp.url}, {resp.raw_response.apparent_encoding}, {resp.raw_response.encoding}, {resp.raw_response.headers}")
+            print(f"error {resp.status}: {resp.error}, {resp.url}, {resp.raw_response.headers}")
         raise
     
     return urls
 
 
+def parse(worker, url, resp):
+    """
+    parse_page of resp, a page with status 200 downloaded for url, in the parser pool of worker if it has one.
+
+    The page is parsed once, the result is kept in resp.parsed, () when the content type is not crawled.
+    With a parser pool the response is only unpickled in the parser process, which also reports the url
+    the page was served from, so the worker reads resp.final_url without unpickling the response.
+    """
+    if resp.parsed is None:
+        # parsing is CPU bound, a pool of parser processes lets it scale past one core.
+        if worker.parsers is not None:
+            resp.final_url, parsed = worker.parsers.submit(
+                parse_pickled_page, url, resp.pickled_response, worker.simhash is not None).result()
+        else:
+            parsed = parse_page(resp.final_url, resp.raw_response, worker.simhash is not None)
+        resp.parsed = parsed or ()
+    return resp.parsed
+
+
+def parse_pickled_page(url, pickled_response, with_fingerprint=False):
+    """ The url a page was served from and parse_page of it, from the pickled response the cache server sent for url. """
+    raw_response = pickle.loads(pickled_response)
+    # relative links of a redirected page are relative to the url it was served from.
+    final_url = getattr(raw_response, "url", None) or url
+    return final_url, parse_page(final_url, raw_response, with_fingerprint)
+
+
+def parse_page(url, raw_response, with_fingerprint=False):
+    """
+    CPU bound part of extract_next_links. It only depends on its arguments, so it can run in a parser process.
+
+    Parameters
+    ----------
+    url: str
+        the actual url of the page
+    raw_response: requests.Response
+        the response
+    with_fingerprint: bool
+        whether to compute the simhash fingerprint of the page
+
+    Returns
+    -------
+    tuple or None
+        (outlinks, word_freq, token_num, fingerprint, timings), fingerprint is None without with_fingerprint.
+        timings maps "parse", "tokenize" and "fingerprint" to the seconds they took.
+        None when the content type is not crawled.
+    """
+    start = time.perf_counter()
+    urls = []
+    if 'Content-Type' not in raw_response.headers or any(format in raw_response.headers['Content-Type'].lower() for format in ["text/html", "text/plain"]):
+        # header, byte order mark and meta charset, then detection over the start of the page.
+        charset = resolve_charset(raw_response.content, raw_response.headers.get('Content-Type'))
+
+        # in case the header or meta charset is wrong
+        try:
+            text = raw_response.content.decode(charset)
+        except UnicodeDecodeError:
+            charset = detect_charset(raw_response.content)
+            text = raw_response.content.decode(charset, errors="replace")
+
+        # if content type is HTML
+        if 'Content-Type' not in raw_response.headers or "text/html" in raw_response.headers['Content-Type'].lower():
+            text, urls = html_text_and_links(text, raw_response.content, charset, url)
+
+        # if content type is plain text
+        elif "text/plain" in raw_response.headers['Content-Type'].lower():
+            urls.extend(txt_to_urls(text, fragments=False))
+        
+        # otherwise, don't crawl
+        else:
+            return None
+
+        timings = {"parse": time.perf_counter() - start}
+        start = time.perf_counter()
+        # if any of the accepted format, compute token statistics
+        word_freq, token_num = count_words(text)
+        timings["tokenize"] = time.perf_counter() - start
+
+        fingerprint = None
+        if with_fingerprint:
+            start = time.perf_counter()
+            fingerprint = compute_simhash(word_freq)
+            timings["fingerprint"] = time.perf_counter() - start
+        return urls, word_freq, token_num, fingerprint, timings
+
+    return None
+
+
+def html_text_and_links(text, content, charset, url):
+    """
+    Parse an html page once with lxml.
+
+    Parameters
+    ----------
+    text: str
+        the decoded page
+    content: bytes
+        the raw page, parsed instead of text when text has an xml encoding declaration lxml refuses
+    charset: str
+        the encoding text was decoded with
+    url: str
+        base url of the relative links
+
+    Returns
+    -------
+    (str, list)
+        the visible text of the page, without script and style elements, and its absolute,
+        fragment-stripped links.
+    """
+    try:
+        try:
+            doc: lh.HtmlElement = lh.document_fromstring(text, base_url=url)
+        except ValueError:
+            doc = lh.document_fromstring(content, parser=lh.HTMLParser(encoding=charset), base_url=url)
+    except etree.ParserError:
+        # empty document
+        return "", []
+
+    # extract urls from the response page
+    doc.make_links_absolute(handle_failures="discard")
+    urls = [urlparse(link)._replace(fragment="").geturl() for _, _, link, _ in doc.iterlinks()]
+
+    # token statistics
+    etree.strip_elements(doc, "script", "style", with_tail=False)
+    return doc.text_content(), urls
+
+
 def is_valid(url):
     # Decide whether to crawl this url or not. 
     # If you decide to crawl it, return True; otherwise return False.
-    # There are already some conditions that return False.
-    try:
-        parsed = urlparse(url)
-        if parsed.scheme not in {"http", "https"}:
-            return False
-        elif all(re.match(".*" + d + "$", parsed.hostname) is None for d in domains):
-            return False
-
-        elif all(d not in parsed.hostname for d in domains):
-            return False
-        elif "swiki.ics.uci.edu" in parsed.hostname:  # a trap
-            return False
-        elif "archive.ics.uci.edu" in parsed.hostname and "ml/datasets.php" in parsed.path:  # a trap
-            return False
-        elif "wics.ics.uci.edu" in parsed.hostname and "events" in parsed.path:  # a trap
-            return False
-        elif "cbcl.ics.uci.edu" in parsed.hostname and "do=diff" in parsed.query:  # a trap
-            return False
-        # check if url belongs to today.uci.edu/department/information_computer_sciences/
-        elif re.match(".*" + "today.uci.edu" + "$", parsed.hostname) is not None:
-            if "department/information_computer_sciences" not in parsed.path:
-                return False
-
-        return not re.match(
-            r".*\.(css|js|bmp|gif|jpe?g|ico"
-            + r"|png|tiff?|mid|mp2|mp3|mp4|webm"
-            + r"|wav|avi|mov|mpeg|ram|m4v|mkv|ogg|ogv|pdf"
-            + r"|ps|eps|tex|ppt|pptx|doc|docx|xls|xlsx|names"
-            + r"|data|dat|exe|bz2|tar|msi|bin|7z|psd|dmg|iso"
-            + r"|epub|dll|cnf|tgz|sha1"
-            + r"|thmx|mso|arff|rtf|jar|csv"
-            + r"|rm|smil|wmv|swf|wma|zip|rar|gz"
-            + r"|r|bib|py|git|pdf)$", parsed.path.lower())
-
-    except TypeError:
-        print("TypeError for ", parsed, url)
-
-        # there may be bad syntax urls. A url can be visited if hostname
-        if parsed.netloc != "":
-            raise
+    # The domain, trap and file extension rules live in url_filter, see utils/url_filter.py.
+    return url_filter.is_valid(url)
+
+
+def canonicalize(url):
+    """ The canonical form of url the frontier keeps, see utils/canonicalize.py. """
+    return canonicalizer.canonicalize(url)
+
+
+# matches the same word as tokenize's \b\S+\b in a whitespace separated chunk: from its first to its last word character.
+WORD_PATTERN = re.compile(r"\w(?:\S*\w)?")
+
+
+# linear time complexity, one pass over the text.
+def count_words(text) -> (Counter, int):
+    """
+    Lowercased word frequencies and number of words of text, with the same words as tokenize.
+    Every whitespace separated chunk holds at most one word, so the chunks are counted first
+    and the regex only runs once per distinct chunk, without building the token list. Like tokenize,
+    the word is lowercased after it is matched: lowercasing first can add characters, e.g. "İ" becomes
+    "i" and a combining dot, which would end the word before the dot.
+    """
+    word_freq = Counter()
+    for chunk, count in Counter(text.split()).items():
+        match = WORD_PATTERN.search(chunk)
+        if match is not None:
+            word_freq[match.group().lower()] += count
+    return word_freq, sum(word_freq.values())
 
 
 # linear time complexity (maybe slower than linear, but faster than n squared).
@@ -20,11 +20,10 @@ for url in urls:
     for link in txt_to_urls(url, fragments=False):
         print(link)
 
-import pickle
+from crawler.stats import CrawlStats
 
-with open("stats_0.pickle", 'rb') as file:
-    crawled_urls, (max_url, max_word_num), total_word_freq, ics_subdomains = pickle.load(file)
-print(len(crawled_urls), "urls crawled")
+stats = CrawlStats("stats.pickle", restart=False)
+print(len(stats), "urls crawled")
 print("subdomains:")
-for d in sorted(ics_subdomains):
-    print(d, "->", sum(1 for page in crawled_urls if d in urlparse(page).hostname))
\ No newline at end of file
+for d in sorted(stats.subdomain_pages):
+    print(d, "->", stats.subdomain_pages[d])
@@ -0,0 +1,54 @@
+import math
+
+
+class BloomFilter(object):
+    """ Fixed capacity Bloom filter over url hashes (hex strings from utils.get_urlhash). """
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def add(self, urlhash):
+        # double hashing over two independent 64 bit slices of the sha256 digest. The step is odd and
+        # below num_bits, a step of num_bits would set the same bit num_hashes times.
+        pos = int(urlhash[:16], 16) % self.num_bits
+        step = int(urlhash[16:32], 16) % (self.num_bits - 1) | 1
+        bits = self.bits
+        for _ in range(self.num_hashes):
+            bits[pos >> 3] |= 1 << (pos & 7)
+            pos = (pos + step) % self.num_bits
+        self.count += 1
+
+    def __contains__(self, urlhash):
+        pos = int(urlhash[:16], 16) % self.num_bits
+        step = int(urlhash[16:32], 16) % (self.num_bits - 1) | 1
+        bits = self.bits
+        for _ in range(self.num_hashes):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+            pos = (pos + step) % self.num_bits
+        return True
+
+
+class ScalableBloomFilter(object):
+    """
+    Bloom filter that grows by chaining filters of increasing capacity and tightening error rate,
+    so the overall false positive rate stays below `error_rate` however many urls are added.
+    """
+    def __init__(self, initial_capacity=1000000, error_rate=0.001, growth=4, tightening=0.5):
+        self.growth = growth
+        self.tightening = tightening
+        self.filters = [BloomFilter(initial_capacity, error_rate * (1 - tightening))]
+
+    def add(self, urlhash):
+        last = self.filters[-1]
+        if last.count >= last.capacity:
+            last = BloomFilter(last.capacity * self.growth, last.error_rate * self.tightening)
+            self.filters.append(last)
+        last.add(urlhash)
+
+    def __contains__(self, urlhash):
+        return any(urlhash in bloom for bloom in self.filters)
@@ -0,0 +1,99 @@
+import time
+import pickle
+import cbor
+
+from threading import Thread
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from requests.models import Response as RawResponse
+from requests.structures import CaseInsensitiveDict
+
+
+def make_raw_response(url, status, headers, content):
+    """ Build the requests.Response object the cache server pickles into its answers. """
+    raw = RawResponse()
+    raw.url = url
+    raw.status_code = status
+    raw.headers = CaseInsensitiveDict(headers)
+    raw._content = content
+    raw.encoding = None
+    if "charset=" in raw.headers.get("Content-Type", ""):
+        raw.encoding = raw.headers["Content-Type"].split("charset=")[-1].strip()
+    return raw
+
+
+def save_pages(pages, path):
+    """ Write a dict of url -> (status, headers, content[, final url]) to a cbor file, to replay it later. """
+    with open(path, 'wb') as file:
+        file.write(cbor.dumps({url: [page[0], dict(page[1]), *page[2:]] for url, page in pages.items()}))
+
+
+def load_pages(path):
+    """ Read the pages written by save_pages, as the `pages` of a CacheServerStub. """
+    with open(path, 'rb') as file:
+        return {url: tuple(page) for url, page in cbor.loads(file.read()).items()}
+
+
+class CacheServerStub(object):
+    """
+    Local stand-in for the spacetime cache server. It answers GET /?q=<url>&u=<useragent> with the same
+    CBOR encoded payload as the cache server, so utils.download.download works against it unchanged.
+
+    `pages` maps a url to (status, headers, content), or is a function of the url returning that tuple.
+    A fourth item is the url the page was served from, to imitate a redirect the cache server followed.
+    Unknown urls get status 404. `latency` seconds are slept before answering, to imitate the network.
+    Use `address` as config.cache_server.
+    """
+    def __init__(self, pages, host="127.0.0.1", port=0, latency=0.0):
+        self.pages = pages
+        self.latency = latency
+        self.requests_count = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # send headers and body in one segment, keep-alive connections otherwise stall on delayed acks.
+            disable_nagle_algorithm = True
+            wbufsize = -1
+
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                body = cbor.dumps(stub.answer(query["q"][0]))
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def address(self):
+        return self.server.server_address[:2]
+
+    def answer(self, url):
+        self.requests_count += 1
+        if self.latency:
+            time.sleep(self.latency)
+        page = self.pages(url) if callable(self.pages) else self.pages.get(url)
+        if page is None:
+            page = (404, {"Content-Type": "text/html"}, b"")
+        status, headers, content = page[:3]
+        final_url = page[3] if len(page) > 3 else url
+        if 600 <= status < 700:
+            # cache server errors have no raw response
+            return {"url": url, "status": status, "error": content.decode("utf-8")}
+        raw_response = make_raw_response(final_url, status, headers, content)
+        return {"url": url, "status": status, "response": pickle.dumps(raw_response)}
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,154 @@
+import re
+
+from collections import Counter
+from threading import RLock
+from hashlib import sha256
+from urllib.parse import urlsplit, urlunsplit, unquote_plus
+
+from utils.bloom import ScalableBloomFilter
+
+
+# Rules applied by default, in this order. "www" is off by default: is_valid needs a label in front
+# of the allowed domains, so folding www.ics.uci.edu into ics.uci.edu would make the url invalid.
+DEFAULT_RULES = [
+    "lowercase_host", "default_port", "percent_encoding", "strip_params", "sort_query", "index_page",
+    "fragment", "trailing_slash"]
+ALL_RULES = DEFAULT_RULES + ["www"]
+
+# query parameters that only track the visitor or its session, names are compared lowercased.
+# A name ending with "*" strips every parameter starting with it.
+DEFAULT_STRIP_PARAMS = [
+    "utm_*", "fbclid", "gclid", "msclkid", "mc_cid", "mc_eid",
+    "sid", "sessionid", "session_id", "phpsessid", "jsessionid", "sessid", "cfid", "cftoken"]
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+INDEX_PAGE_PATTERN = re.compile(r"/(?:index|default)\.(?:html?|php|aspx?|jsp)$", re.IGNORECASE)
+PERCENT_PATTERN = re.compile(r"%[0-9a-fA-F]{2}")
+SESSION_PATH_PATTERN = re.compile(r";(?:jsessionid|phpsessid|sid)=[^/?#]*", re.IGNORECASE)
+UNRESERVED = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~")
+
+
+def _normalize_escape(match):
+    """ Decode a percent escape of an unreserved character, uppercase the hex digits of the others. """
+    char = chr(int(match.group(0)[1:], 16))
+    return char if char in UNRESERVED else match.group(0).upper()
+
+
+class Canonicalizer(object):
+    """
+    Rewrites urls into one canonical form, so spellings of the same page share one frontier entry.
+
+    `rules` are names out of ALL_RULES: lowercase_host, default_port (drop :80 for http and :443 for https),
+    www (drop a leading "www."), percent_encoding (uppercase escapes, decode escaped unreserved characters),
+    strip_params (`strip_params` query parameters and ;jsessionid= path parameters), sort_query (by name),
+    index_page (drop index.html and the like when there is no query), fragment and trailing_slash
+    (like utils.normalize, the slash of a path followed by a query stays), applied in this order.
+    Query parameters keep their spelling, they are only dropped or reordered.
+
+    canonicalize() only rewrites. collapse() also counts how often each rule rewrote a link, and how many
+    distinct links turned into a url another distinct link already turned into, i.e. the frontier entries
+    and downloads the rules saved. The distinct links are counted with Bloom filters, so the counts are
+    approximate, within the error rate of the filters. The links are hashed before the lock is taken, a link
+    no rule changed is its own canonical url and is hashed once.
+    """
+    def __init__(self, rules=None, strip_params=None, initial_capacity=100000):
+        rules = DEFAULT_RULES if rules is None else rules
+        assert set(rules) <= set(ALL_RULES), f"Unknown canonicalization rules {set(rules) - set(ALL_RULES)}"
+        self.rules = set(rules)
+        strip_params = DEFAULT_STRIP_PARAMS if strip_params is None else strip_params
+        self.strip_names = frozenset(name.lower() for name in strip_params if not name.endswith("*"))
+        self.strip_prefixes = tuple(name.lower()[:-1] for name in strip_params if name.endswith("*"))
+        self.lock = RLock()
+        self.raw_urls = ScalableBloomFilter(initial_capacity)
+        self.canonical_urls = ScalableBloomFilter(initial_capacity)
+        self.links = 0
+        self.distinct_links = 0
+        self.collapsed = 0
+        self.rule_hits = Counter()
+
+    def _stripped(self, name):
+        name = name.lower()
+        return name in self.strip_names or name.startswith(self.strip_prefixes)
+
+    def _rewrite(self, url, hits=None):
+        """ Canonical form of url. Appends the names of the rules that changed it to hits. """
+        rules = self.rules
+        try:
+            parts = urlsplit(url)
+            port = parts.port
+        except ValueError:
+            # e.g. an invalid port or IPv6 netloc, is_valid rejects it anyway
+            return url
+        scheme, netloc, path, query, fragment = parts
+
+        def apply(rule, before, after):
+            if hits is not None and before != after:
+                hits.append(rule)
+            return after
+
+        userinfo, at, host = netloc.rpartition("@")
+        if "lowercase_host" in rules:
+            host = apply("lowercase_host", host, host.lower())
+        if "default_port" in rules and port is not None and DEFAULT_PORTS.get(scheme) == port:
+            host = apply("default_port", host, host.rsplit(":", 1)[0])
+        if "www" in rules and host[:4].lower() == "www.":
+            host = apply("www", host, host[4:])
+        netloc = userinfo + at + host
+        if "percent_encoding" in rules and "%" in url:
+            path = apply("percent_encoding", path, PERCENT_PATTERN.sub(_normalize_escape, path))
+            query = apply("percent_encoding", query, PERCENT_PATTERN.sub(_normalize_escape, query))
+        if "strip_params" in rules and ";" in path:
+            path = apply("strip_params", path, SESSION_PATH_PATTERN.sub("", path))
+        if query and ("strip_params" in rules or "sort_query" in rules):
+            params = query.split("&")
+            if "strip_params" in rules:
+                params = apply("strip_params", params, [
+                    param for param in params if not self._stripped(unquote_plus(param.split("=", 1)[0]))])
+            if "sort_query" in rules:
+                # by name only: the values of a repeated name keep their order, e.g. for a[]=2&a[]=1
+                params = apply("sort_query", params, sorted(params, key=lambda param: param.split("=", 1)[0]))
+            query = "&".join(params)
+        # with a query the index page is the script answering it, e.g. index.php?title=Foo
+        if "index_page" in rules and not query:
+            path = apply("index_page", path, INDEX_PAGE_PATTERN.sub("/", path))
+        if "fragment" in rules:
+            fragment = apply("fragment", fragment, "")
+        url = urlunsplit((scheme, netloc, path, query, fragment))
+        if "trailing_slash" in rules and url.endswith("/"):
+            url = apply("trailing_slash", url, url.rstrip("/"))
+        return url
+
+    def canonicalize(self, url):
+        return self._rewrite(url)
+
+    def collapse(self, urls):
+        """ Canonicalize urls scraped from a page, and count what the rules collapsed. """
+        canonical_urls = []
+        rule_hits = Counter()
+        hashes = []
+        for url in urls:
+            hits = []
+            canonical = self._rewrite(url, hits)
+            canonical_urls.append(canonical)
+            rule_hits.update(set(hits))
+            raw_hash = sha256(url.encode("utf-8")).hexdigest()
+            canonical_hash = raw_hash if canonical == url else sha256(canonical.encode("utf-8")).hexdigest()
+            hashes.append((raw_hash, canonical_hash))
+        with self.lock:
+            self.links += len(hashes)
+            self.rule_hits.update(rule_hits)
+            for raw_hash, canonical_hash in hashes:
+                if raw_hash not in self.raw_urls:
+                    self.raw_urls.add(raw_hash)
+                    self.distinct_links += 1
+                    if canonical_hash in self.canonical_urls:
+                        self.collapsed += 1
+                    else:
+                        self.canonical_urls.add(canonical_hash)
+        return canonical_urls
+
+    def summary(self):
+        with self.lock:
+            rules = ", ".join(f"{rule} {count}" for rule, count in self.rule_hits.most_common())
+            return (f"Canonicalized {self.links} links, {self.distinct_links} distinct. "
+                    f"{self.collapsed} collapsed into the url of another link. Rewrites: {rules or 'none'}")
@@ -0,0 +1,92 @@
+import re
+import codecs
+
+# the detector requests.Response.apparent_encoding runs, chardet or charset_normalizer
+from requests.compat import chardet
+
+BOMS = [
+    (codecs.BOM_UTF32_LE, "utf-32"), (codecs.BOM_UTF32_BE, "utf-32"), (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"), (codecs.BOM_UTF16_BE, "utf-16")]
+HEADER_CHARSET_PATTERN = re.compile(r"charset\s*=\s*[\"']?([\w.:-]+)", re.IGNORECASE)
+# <meta charset="x">, <meta http-equiv="Content-Type" content="text/html; charset=x"> and <?xml encoding="x"?>
+META_CHARSET_PATTERN = re.compile(
+    rb"<meta[^>]+?charset\s*=\s*[\"']?\s*([\w.:-]+)|<\?xml[^>]+?encoding\s*=\s*[\"']([\w.:-]+)", re.IGNORECASE)
+# the html spec only looks for the meta charset in the first 1024 bytes, some pages put it a bit later.
+META_BYTES = 4096
+SAMPLE_BYTES = 32 * 1024
+# the detector learns nothing from ascii bytes but its time grows with them, it is only given the words with
+# non-ascii bytes in the sample, whole words until they add up to DETECT_BYTES.
+DETECT_BYTES = 512
+NON_ASCII_WORD_PATTERN = re.compile(rb"[\x21-\x7e]*[\x80-\xff][\x21-\xff]*")
+# single byte latin code pages the detector cannot tell apart from windows-1252 on mostly English pages,
+# where windows-1252 is what browsers assume.
+WESTERN_CODECS = {"cp1250", "cp1254", "cp1257", "iso8859-1", "iso8859-2", "iso8859-4", "iso8859-9",
+                  "iso8859-13", "iso8859-15"}
+
+
+def _codec(name):
+    """ Python name of the encoding called name, None if there is no such codec. """
+    if not name:
+        return None
+    try:
+        return codecs.lookup(name.decode("ascii") if isinstance(name, bytes) else name).name
+    except (LookupError, UnicodeDecodeError):
+        return None
+
+
+def header_charset(content_type):
+    """ Charset parameter of a Content-Type header, None if it has none or names no codec. """
+    match = HEADER_CHARSET_PATTERN.search(content_type or "")
+    return _codec(match.group(1)) if match else None
+
+
+def bom_charset(content):
+    for bom, charset in BOMS:
+        if content.startswith(bom):
+            return charset
+    return None
+
+
+def meta_charset(content):
+    """ Charset declared by a meta tag or xml declaration in the first META_BYTES of the page. """
+    match = META_CHARSET_PATTERN.search(content, 0, META_BYTES)
+    if match is None:
+        return None
+    charset = _codec(match.group(1) or match.group(2))
+    # a page that declares utf-16 in ascii bytes is not utf-16, the declaration was copied along.
+    return "utf-8" if charset is not None and charset.startswith("utf-16") else charset
+
+
+def detect_charset(content, sample_size=SAMPLE_BYTES):
+    """
+    Guess the charset of content from its first sample_size bytes: utf-8 if they decode as utf-8,
+    otherwise what the detector finds in their words with non-ascii bytes, windows-1252 if it finds nothing
+    or a latin code page.
+    """
+    sample = content[:sample_size]
+    try:
+        # not final: the sample may end in the middle of a multi-byte character
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        pass
+    if chardet is None:
+        return "cp1252"
+    words = []
+    length = 0
+    for match in NON_ASCII_WORD_PATTERN.finditer(sample):
+        words.append(match.group())
+        length += len(match.group()) + 1
+        if length >= DETECT_BYTES:
+            break
+    detected = _codec(chardet.detect(b" ".join(words))["encoding"])
+    return "cp1252" if detected is None or detected in WESTERN_CODECS else detected
+
+
+def resolve_charset(content, content_type=None):
+    """
+    Charset to decode a page with: a byte order mark, the Content-Type header or the meta charset, in this
+    order like browsers do, and detection over a bounded sample of the page when none names a known codec.
+    Never reads more than SAMPLE_BYTES of content, unlike apparent_encoding, which detects over all of it.
+    """
+    return bom_charset(content) or header_charset(content_type) or meta_charset(content) or detect_charset(content)
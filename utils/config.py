@@ -1,5 +1,7 @@
 import re
 
+from utils.url_filter import parse_trap_rule
+
 
 class Config(object):
     def __init__(self, config):
@@ -8,13 +10,56 @@ class Config(object):
         assert self.user_agent != "DEFAULT AGENT", "Set useragent in config.ini"
         assert re.match(r"^[a-zA-Z0-9_ ,]+$", self.user_agent), "User agent should not have any special characters outside '_', ',' and 'space'"
         self.threads_count = int(config["LOCAL PROPERTIES"]["THREADCOUNT"])
+        # 0 means every worker downloads its own urls, otherwise FETCHERS threads download for the workers.
+        self.fetchers_count = int(config["LOCAL PROPERTIES"].get("FETCHERS", 0))
+        self.download_queue_size = int(config["LOCAL PROPERTIES"].get("DOWNLOADQUEUE", 16))
+        # 0 means workers parse pages in their own thread, otherwise in a pool of PARSERS processes.
+        self.parsers_count = int(config["LOCAL PROPERTIES"].get("PARSERS", 0))
         self.save_file = config["LOCAL PROPERTIES"]["SAVE"]
+        self.flush_interval = float(config["LOCAL PROPERTIES"].get("FLUSHINTERVAL", 1.0))
+        # every host keeps up to QUEUEHEAD urls in memory, the rest of its queue is spilled to files in SPILLDIR.
+        self.queue_head_size = int(config["LOCAL PROPERTIES"].get("QUEUEHEAD", 1000))
+        self.spill_dir = config["LOCAL PROPERTIES"].get("SPILLDIR", "frontier_spill")
         self.simhash_file = config["LOCAL PROPERTIES"]["SIMHASH"] if "SIMHASH" in config["LOCAL PROPERTIES"] else None
+        # directory the downloaded pages are stored in for launch.py --reprocess, None (empty) to not store them.
+        self.page_store = config["LOCAL PROPERTIES"].get("PAGESTORE", "").strip() or None
+        self.stats_checkpoint_pages = int(config["LOCAL PROPERTIES"].get("STATSCHECKPOINTPAGES", 100))
+        self.stats_checkpoint_interval = float(config["LOCAL PROPERTIES"].get("STATSCHECKPOINTINTERVAL", 60.0))
+        # stage timings and counters are logged and appended to METRICSFILE every METRICSINTERVAL seconds.
+        self.metrics_file = config["LOCAL PROPERTIES"].get("METRICSFILE", "metrics.jsonl")
+        self.metrics_interval = float(config["LOCAL PROPERTIES"].get("METRICSINTERVAL", 60.0))
 
         self.host = config["CONNECTION"]["HOST"]
         self.port = int(config["CONNECTION"]["PORT"])
+        self.download_timeout = float(config["CONNECTION"].get("TIMEOUT", 30))
+        self.download_retries = int(config["CONNECTION"].get("RETRIES", 3))
+        self.download_backoff = float(config["CONNECTION"].get("BACKOFF", 0.5))
+        # maximum number of requests to the cache server in flight at once
+        self.max_in_flight = max(self.threads_count, self.fetchers_count)
 
         self.seed_urls = config["CRAWLER"]["SEEDURL"].split(",")
         self.time_delay = float(config["CRAWLER"]["POLITENESS"])
+        # None keeps the default trap rules of utils/url_filter.py
+        self.trap_rules = [parse_trap_rule(rule) for rule in config["TRAPS"].values()] if "TRAPS" in config else None
+        # None keeps the defaults of utils/canonicalize.py
+        canonicalize = config["CANONICALIZE"] if "CANONICALIZE" in config else dict()
+        self.canonical_rules = [
+            rule.strip() for rule in canonicalize["RULES"].split(",")] if "RULES" in canonicalize else None
+        self.strip_params = [
+            name.strip() for name in canonicalize["STRIPPARAMS"].split(",")] if "STRIPPARAMS" in canonicalize else None
+        # thresholds of crawler.traps.TrapDetector, its decisions are kept in FILE across runs.
+        detector = config["TRAPDETECTOR"] if "TRAPDETECTOR" in config else dict()
+        self.trap_file = detector.get("FILE", "traps.json")
+        self.trap_max_depth = int(detector.get("MAXDEPTH", 12))
+        self.trap_max_repeats = int(detector.get("MAXREPEATS", 3))
+        self.trap_query_variants = int(detector.get("QUERYVARIANTS", 200))
+        self.trap_date_urls = int(detector.get("DATEURLS", 100))
+        self.trap_duplicate_rate = float(detector.get("DUPLICATERATE", 0.5))
+        self.trap_duplicate_samples = int(detector.get("DUPLICATESAMPLES", 20))
+        # order of the queued urls, see crawler/priority.py
+        priority = config["PRIORITY"] if "PRIORITY" in config else dict()
+        self.priority_policy = priority.get("POLICY", "yield").strip()
+        self.priority_depth_weight = float(priority.get("DEPTHWEIGHT", 0.1))
+        self.priority_novelty_weight = float(priority.get("NOVELTYWEIGHT", 1.0))
 
         self.cache_server = None
\ No newline at end of file
@@ -2,13 +2,39 @@ import requests
 import cbor
 import time
 
+from threading import Lock
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
 from utils.response import Response
 
+_sessions = dict()
+_sessions_lock = Lock()
+
+def get_session(config):
+    """
+    Session shared by every thread that downloads through the cache server in config.
+    It keeps up to config.max_in_flight keep-alive connections to the cache server, and retries
+    connection errors and 502/503/504 answers with exponential backoff.
+    """
+    key = (config.cache_server, config.max_in_flight, config.download_retries, config.download_backoff)
+    with _sessions_lock:
+        if key not in _sessions:
+            session = requests.Session()
+            retries = Retry(
+                total=config.download_retries, backoff_factor=config.download_backoff,
+                status_forcelist=[502, 503, 504], allowed_methods=["GET"], raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config.max_in_flight, max_retries=retries)
+            session.mount("http://", adapter)
+            _sessions[key] = session
+        return _sessions[key]
+
 def download(url, config, logger=None):
     host, port = config.cache_server
-    resp = requests.get(
+    resp = get_session(config).get(
         f"http://{host}:{port}/",
-        params=[("q", f"{url}"), ("u", f"{config.user_agent}")])
+        params=[("q", f"{url}"), ("u", f"{config.user_agent}")],
+        timeout=config.download_timeout)
     try:
         if resp and resp.content:
             return Response(cbor.loads(resp.content))
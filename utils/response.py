@@ -1,14 +1,49 @@
 import pickle
 
+from urllib.parse import urljoin
+
 class Response(object):
     def __init__(self, resp_dict):
         self.url = resp_dict["url"]
         self.status = resp_dict["status"]
         self.error = resp_dict["error"] if "error" in resp_dict else None
-        try:
-            self.raw_response = (
-                pickle.loads(resp_dict["response"])
-                if "response" in resp_dict else
-                None)
-        except TypeError:
-            self.raw_response = None
+        # the requests.Response as the cache server pickled it, unpickled by raw_response when it is used.
+        self.pickled_response = resp_dict["response"] if "response" in resp_dict else None
+        self._raw_response = None
+        # set by a parser process that unpickled the response, so final_url does not unpickle it again.
+        self._final_url = None
+        # what scraper.parse_page returned once scraper.parse parsed the page, () if it is not crawled.
+        self.parsed = None
+
+    @property
+    def raw_response(self):
+        if self._raw_response is None and self.pickled_response is not None:
+            try:
+                self._raw_response = pickle.loads(self.pickled_response)
+            except TypeError:
+                self.pickled_response = None
+        return self._raw_response
+
+    @property
+    def final_url(self):
+        """ The url the page was served from after redirects, url when it was not redirected. """
+        if self._final_url is None:
+            # only a page is unpickled for it, the url of an error or redirect answer is not used.
+            if self.status == 200 and self.raw_response is not None and getattr(self.raw_response, "url", None):
+                self._final_url = self.raw_response.url
+            else:
+                self._final_url = self.url
+        return self._final_url
+
+    @final_url.setter
+    def final_url(self, url):
+        self._final_url = url
+
+    @property
+    def location(self):
+        """ The target of a redirect that was not followed, None unless status is 3xx with a Location header. """
+        if 300 <= self.status < 400 and self.raw_response is not None:
+            location = self.raw_response.headers.get("Location")
+            if location:
+                return urljoin(self.url, location)
+        return None
@@ -0,0 +1,31 @@
+from hashlib import blake2b
+import numpy as np
+
+
+def compute_simhash(word_freq, digest_size=32):
+    """
+    Simhash fingerprint of a page. Kept out of crawler.simhash so parser processes compute it without
+    importing the crawler.
+
+    Parameters
+    ----------
+    word_freq: dict
+        keys are tokens, values are the number of occurance of the token in a document.
+    digest_size: int
+        number of BYTES the hash function encodes the data into
+
+    Returns
+    -------
+    bytes
+        fingerprint of digest_size * 8 bits, most significant bit first.
+    """
+    if not word_freq:
+        return bytes(digest_size)
+    num_tokens = len(word_freq)
+    buffer = b"".join(blake2b(token.encode("utf-8"), digest_size=digest_size).digest() for token in word_freq)
+    # one row of digest_size * 8 bits per token
+    bits = np.unpackbits(np.frombuffer(buffer, dtype=np.uint8)).reshape(num_tokens, digest_size * 8)
+    weights = np.fromiter(word_freq.values(), dtype=np.int64, count=num_tokens)
+    # simhash treats 0 bits as negative sign: sum(freq * (2 * bit - 1)) == 2 * (freq @ bits) - sum(freq)
+    simhash = 2 * (weights @ bits) - weights.sum()
+    return np.packbits(simhash > 0).tobytes()
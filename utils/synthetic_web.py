@@ -0,0 +1,143 @@
+import random
+import datetime
+
+from urllib.parse import urlparse
+
+
+class SyntheticWeb(object):
+    """
+    A generated ICS-like web graph, as the `pages` function of utils.cache_stub.CacheServerStub.
+
+    Page i lives at https://<host>/p/<i> on one of `hosts` subdomains of ics.uci.edu, the seed
+    https://www.ics.uci.edu is page 0. Every page has `words` words drawn from a Zipf-like vocabulary and
+    `fan_out` links to other pages. The graph is a function of its parameters and `seed`, pages are
+    generated when they are requested, so a large web costs no memory. Besides the regular pages:
+    - `duplicates` of the pages have the same text as the page before them (near duplicates for simhash),
+    - `redirects` of the links point to /old/<i>, which the cache server answers with page i after
+      following the redirect,
+    - `non_html` of the links point to pdf files and plain text pages,
+    - `errors` of the pages answer 404, or 604 like a cache server error,
+    - `traps` hosts serve an events calendar with a page per day, each linking to the next and previous
+      day, which never ends. Every regular page links to one of them with probability `trap_links`,
+    - `archives` hosts serve `pages` paginated archive pages, with too few words to be counted, each
+      linking to the next three archive pages and one regular page. Every regular page links to one of
+      them with probability `trap_links`,
+    - links out of the allowed domains and to files is_valid rejects.
+    """
+    def __init__(self, pages=1000, hosts=20, fan_out=10, words=400, duplicates=0.05, redirects=0.05,
+                 non_html=0.05, errors=0.02, traps=1, archives=0, trap_links=0.05, vocabulary=20000, seed=0):
+        self.pages = pages
+        self.hosts = ["www.ics.uci.edu"] + [f"group{i}.ics.uci.edu" for i in range(1, hosts)]
+        self.fan_out = fan_out
+        self.words = words
+        self.duplicates = duplicates
+        self.redirects = redirects
+        self.non_html = non_html
+        self.errors = errors
+        self.trap_hosts = [f"calendar{i}.ics.uci.edu" for i in range(traps)]
+        self.archive_hosts = [f"archive{i}.ics.uci.edu" for i in range(archives)]
+        self.trap_links = trap_links
+        self.seed = seed
+        self.vocabulary = [f"word{i}" for i in range(vocabulary)]
+        # Zipf-like: the i-th word is drawn with weight 1 / (i + 1)
+        self.cumulative_weights = []
+        total = 0.0
+        for i in range(vocabulary):
+            total += 1 / (i + 1)
+            self.cumulative_weights.append(total)
+
+    @property
+    def seed_urls(self):
+        return ["https://www.ics.uci.edu"]
+
+    def url(self, i):
+        return f"https://{self.hosts[i % len(self.hosts)]}/p/{i}"
+
+    def _rng(self, i):
+        return random.Random(self.seed * 1000003 + i)
+
+    def _text(self, i):
+        rng = self._rng(i)
+        if i > 0 and rng.random() < self.duplicates:
+            return self._text(i - 1)
+        return " ".join(rng.choices(self.vocabulary, cum_weights=self.cumulative_weights, k=self.words))
+
+    def _links(self, i):
+        rng = self._rng(-i - 1)
+        links = []
+        for _ in range(self.fan_out):
+            target = rng.randrange(self.pages)
+            draw = rng.random()
+            if draw < self.redirects:
+                links.append(f"https://{self.hosts[target % len(self.hosts)]}/old/{target}")
+            elif draw < self.redirects + self.non_html:
+                links.append(f"https://{self.hosts[target % len(self.hosts)]}/files/{target}"
+                             + (".txt" if target % 2 else ""))
+            else:
+                links.append(self.url(target))
+        if self.trap_hosts and rng.random() < self.trap_links:
+            day = datetime.date(2020, 1, 1) + datetime.timedelta(days=rng.randrange(365))
+            links.append(f"https://{rng.choice(self.trap_hosts)}/events/{day}")
+        if self.archive_hosts and rng.random() < self.trap_links:
+            links.append(f"https://{rng.choice(self.archive_hosts)}/archive/{rng.randrange(self.pages)}")
+        # rejected by is_valid
+        links.append(f"https://www.example.com/p/{i}")
+        links.append(f"https://{self.hosts[i % len(self.hosts)]}/slides/{i}.pdf")
+        return links
+
+    @staticmethod
+    def _html(title, text, links):
+        anchors = "".join(f'<a href="{link}">{link.rsplit("/", 1)[-1]}</a> ' for link in links)
+        page = f"<html><head><title>{title}</title></head><body><h1>{title}</h1><p>{text}</p>{anchors}</body></html>"
+        return 200, {"Content-Type": "text/html; charset=utf-8"}, page.encode("utf-8")
+
+    def _calendar(self, host, path):
+        try:
+            day = datetime.date.fromisoformat(path.rsplit("/", 1)[-1])
+        except ValueError:
+            return 404, {"Content-Type": "text/html"}, b""
+        links = [f"https://{host}/events/{day + datetime.timedelta(days=1)}",
+                 f"https://{host}/events/{day - datetime.timedelta(days=1)}"]
+        text = " ".join(self.vocabulary[:50]) + f" events of {day}"
+        return self._html(f"Events {day}", text, links)
+
+    def _archive(self, host, path):
+        number = path.rsplit("/", 1)[-1]
+        if not number.isdigit() or int(number) >= self.pages:
+            return 404, {"Content-Type": "text/html"}, b""
+        i = int(number)
+        links = [f"https://{host}/archive/{j}" for j in range(i + 1, min(i + 4, self.pages))]
+        links.append(self.url(self._rng(-3 * i - 3).randrange(self.pages)))
+        text = " ".join(self.vocabulary[:40]) + f" archive page {i}"
+        return self._html(f"Archive {i}", text, links)
+
+    def __call__(self, url):
+        parsed = urlparse(url)
+        host, path = parsed.hostname or "", parsed.path.rstrip("/")
+        if host in self.trap_hosts and path.startswith("/events/"):
+            return self._calendar(host, path)
+        if host in self.archive_hosts and path.startswith("/archive/"):
+            return self._archive(host, path)
+        if host not in self.hosts:
+            return None
+        if path == "" and host == self.hosts[0]:
+            i = 0
+        else:
+            kind, _, number = path.strip("/").partition("/")
+            number = number.split(".", 1)[0]
+            if not number.isdigit() or int(number) >= self.pages:
+                return None
+            i = int(number)
+            if kind == "old":
+                status, headers, content = self(self.url(i))
+                return status, headers, content, self.url(i)
+            if kind == "files":
+                if path.endswith(".txt"):
+                    return 200, {"Content-Type": "text/plain"}, self._text(i).encode("utf-8")
+                return 200, {"Content-Type": "application/pdf"}, b"%PDF-1.4 " + bytes(1000)
+            if kind != "p" or self.url(i) != f"https://{host}/p/{i}":
+                return None
+        draw = self._rng(-2 * i - 2).random()
+        if i > 0 and draw < self.errors:
+            return (404, {"Content-Type": "text/html"}, b"") if draw < self.errors / 2 else (604, {}, b"timeout")
+        return self._html(f"Page {i}", self._text(i), self._links(i))
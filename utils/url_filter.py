@@ -0,0 +1,108 @@
+import re
+
+from collections import namedtuple
+from functools import lru_cache
+from urllib.parse import urlparse
+
+
+# A declarative trap rule. It applies to urls whose hostname is `host` or a subdomain of it.
+# action "block": the url is rejected when `needle` occurs in its `field` ("path" or "query").
+# action "require": the url is rejected unless `needle` occurs in its `field`.
+TrapRule = namedtuple("TrapRule", ["host", "field", "needle", "action"])
+
+DEFAULT_TRAP_RULES = [
+    TrapRule("swiki.ics.uci.edu", "path", "", "block"),
+    TrapRule("archive.ics.uci.edu", "path", "ml/datasets.php", "block"),
+    TrapRule("wics.ics.uci.edu", "path", "events", "block"),
+    TrapRule("cbcl.ics.uci.edu", "query", "do=diff", "block"),
+    # only the ICS department pages of today.uci.edu
+    TrapRule("today.uci.edu", "path", "department/information_computer_sciences", "require"),
+]
+
+EXTENSION_PATTERN = re.compile(
+    r"\.(css|js|bmp|gif|jpe?g|ico"
+    + r"|png|tiff?|mid|mp2|mp3|mp4|webm"
+    + r"|wav|avi|mov|mpeg|ram|m4v|mkv|ogg|ogv|pdf"
+    + r"|ps|eps|tex|ppt|pptx|doc|docx|xls|xlsx|names"
+    + r"|data|dat|exe|bz2|tar|msi|bin|7z|psd|dmg|iso"
+    + r"|epub|dll|cnf|tgz|sha1"
+    + r"|thmx|mso|arff|rtf|jar|csv"
+    + r"|rm|smil|wmv|swf|wma|zip|rar|gz"
+    + r"|r|bib|py|git|pdf)$")
+
+
+def parse_trap_rule(value):
+    """ Parse a trap rule from config, "host field needle [require]", e.g. "cbcl.ics.uci.edu query do=diff". """
+    parts = value.split()
+    if len(parts) == 2:
+        # no needle, e.g. "swiki.ics.uci.edu path" blocks the whole host
+        parts.append("")
+    action = parts[3] if len(parts) > 3 else "block"
+    assert parts[1] in {"path", "query"} and action in {"block", "require"}, f"Invalid trap rule {value}"
+    return TrapRule(parts[0], parts[1], parts[2], action)
+
+
+class URLFilter(object):
+    """
+    Decides whether a url may be crawled.
+
+    The allowed domain suffixes (e.g. ".ics.uci.edu", which requires at least one label in front) are compiled
+    into a trie over the reversed hostname labels. The domain decision and the trap rules that apply to a
+    hostname are cached per hostname, so a url only costs a urlparse, its host's rules and the extension regex.
+    """
+    _END = object()
+
+    def __init__(self, domains, trap_rules=None, cache_size=65536):
+        self.trie = dict()
+        for domain in domains:
+            node = self.trie
+            for label in reversed(domain.strip(".").split(".")):
+                node = node.setdefault(label, dict())
+            node[self._END] = True
+        self.trap_rules = list(DEFAULT_TRAP_RULES if trap_rules is None else trap_rules)
+        self.host_decision = lru_cache(maxsize=cache_size)(self._host_decision)
+
+    def _allowed_domain(self, hostname):
+        labels = hostname.split(".")
+        node = self.trie
+        # the last label can't complete a suffix: the hostname needs one more label in front of the domain.
+        for label in reversed(labels[1:]):
+            node = node.get(label)
+            if node is None:
+                return False
+            if self._END in node:
+                return True
+        return False
+
+    def _host_decision(self, hostname):
+        """
+        Returns
+        -------
+        (bool, tuple)
+            whether hostname is in an allowed domain, and the trap rules that apply to it.
+        """
+        rules = tuple(rule for rule in self.trap_rules
+                      if hostname == rule.host or hostname.endswith("." + rule.host))
+        return self._allowed_domain(hostname), rules
+
+    def add_trap_rule(self, rule):
+        self.trap_rules.append(rule)
+        self.host_decision.cache_clear()
+
+    def is_valid(self, url):
+        try:
+            parsed = urlparse(url)
+            hostname = parsed.hostname
+        except ValueError:
+            # e.g. invalid IPv6 netloc
+            return False
+        if parsed.scheme not in {"http", "https"} or not hostname:
+            return False
+        allowed, rules = self.host_decision(hostname)
+        if not allowed:
+            return False
+        for rule in rules:
+            found = rule.needle in (parsed.path if rule.field == "path" else parsed.query)
+            if found == (rule.action == "block"):
+                return False
+        return EXTENSION_PATTERN.search(parsed.path.lower()) is None